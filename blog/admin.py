@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.forms import Textarea
 from django.db import models
 
-from .models import Article, AmazonProduct
+from .models import Article, AmazonProduct, BackfillCheckpoint
 
 
 class ArticleAdmin(admin.ModelAdmin):
@@ -24,5 +24,18 @@ admin.site.register(Article, ArticleAdmin)
 
 @admin.register(AmazonProduct)
 class AmazonProductAdmin(admin.ModelAdmin):
-    list_display = ("asin", "title", "last_fetched_at", "fetch_status")
+    list_display = (
+        "asin",
+        "title",
+        "last_fetched_at",
+        "fetch_status",
+        "queued_at",
+        "fetch_attempts",
+        "next_retry_at",
+    )
     search_fields = ("asin", "title")
+
+
+@admin.register(BackfillCheckpoint)
+class BackfillCheckpointAdmin(admin.ModelAdmin):
+    list_display = ("name", "cursor", "processed", "updated", "started_at", "finished_at")
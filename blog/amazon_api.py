@@ -1,5 +1,5 @@
 import os
-from typing import Optional, Dict
+from typing import Optional, Dict, List, NamedTuple
 
 # Minimal PA-API v5 wrapper. Avoids hard dependency if creds are missing.
 # If you prefer the official SDK or python-amazon-paapi, swap this implementation.
@@ -8,7 +8,18 @@ import hashlib
 import hmac
 import json
 import datetime
+import threading
 import time
+from collections import deque
+
+from . import metrics, timing
+
+# GetItems accepts at most this many ItemIds per request
+PAAPI_MAX_ITEM_IDS = 10
+
+PAAPI_SERVICE = "ProductAdvertisingAPI"
+PAAPI_PATH = "/paapi5/getitems"
+PAAPI_TARGET = "com.amazon.paapi5.v1.ProductAdvertisingAPIv1.GetItems"
 
 PAAPI_HOSTS = {
     "us-east-1": "webservices.amazon.com",
@@ -46,7 +57,9 @@ def _marketplace_for_host(host: str) -> str:
     return "www.amazon.com"
 
 
-def _build_getitems_payload(asin: str, partner_tag: str, marketplace: str, title_only: bool = False) -> Dict:
+def _build_getitems_payload(
+    asins: List[str], partner_tag: str, marketplace: str, title_only: bool = False
+) -> Dict:
     resources = [
         "ItemInfo.Title",
     ]
@@ -56,7 +69,7 @@ def _build_getitems_payload(asin: str, partner_tag: str, marketplace: str, title
             "Images.Primary.Large",
         ])
     return {
-        "ItemIds": [asin],
+        "ItemIds": list(asins),
         "ItemIdType": "ASIN",
         "Resources": resources,
         "PartnerTag": partner_tag,
@@ -65,139 +78,367 @@ def _build_getitems_payload(asin: str, partner_tag: str, marketplace: str, title
     }
 
 
-def fetch_paapi_images(asin: str, verbose: bool = False, title_only: bool = False) -> Optional[Dict[str, str]]:
-    # Lazy import to avoid hard failure if requests isn't installed yet
-    try:
-        import requests  # type: ignore
-    except Exception:
+def _parse_item(item: Dict, title_only: bool = False) -> Optional[Dict[str, str]]:
+    title = item.get("ItemInfo", {}).get("Title", {}).get("DisplayValue")
+    images = item.get("Images", {}).get("Primary", {}) if not title_only else {}
+    medium = images.get("Medium", {}).get("URL") if images else None
+    large = images.get("Large", {}).get("URL") if images else None
+    if not title_only and not (medium or large):
         return None
-    access_key = _get_env("AMAZON_PAAPI_ACCESS_KEY")
-    secret_key = _get_env("AMAZON_PAAPI_SECRET_KEY")
-    partner_tag = _get_env("AMAZON_PAAPI_PARTNER_TAG")
-    region = _get_env("AMAZON_PAAPI_REGION") or "us-east-1"
-
-    if verbose:
-        print(
-            "PA-API env: ACCESS_KEY=%s, SECRET_KEY=%s, PARTNER_TAG=%s, REGION=%s"
-            % (
-                "set" if access_key else "missing",
-                "set" if secret_key else "missing",
-                partner_tag or "missing",
-                region,
-            )
+    return {
+        "title": title,
+        "image_url": (medium or large) if not title_only else None,
+        "image_url_2x": (large or medium) if not title_only else None,
+    }
+
+
+def _error_asin(error: Dict, asins: List[str]) -> Optional[str]:
+    # PA-API names the offending ItemId in the message, e.g.
+    # "The ItemId B000000000 provided in the request is invalid."
+    message = error.get("Message") or ""
+    for asin in asins:
+        if asin in message:
+            return asin
+    return None
+
+
+class PaapiThrottled(Exception):
+    """PA-API answered HTTP 429 / TooManyRequests; retry later rather than record a miss."""
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket limiter with adaptive backoff.
+
+    ``rate`` tokens are added per second, up to ``burst`` banked. ``backoff``
+    halves the current rate after throttling and ``recover`` creeps it back
+    towards the configured rate after successful calls.
+    """
+
+    def __init__(self, rate: float, burst: int = 1, min_rate: float = 0.05):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.min_rate = min(min_rate, rate)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self) -> None:
+        """Block until a token is available, then take it."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def backoff(self, factor: float = 0.5) -> None:
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = max(self.min_rate, self.rate * factor)
+            self.tokens = 0.0
+
+    def recover(self, factor: float = 1.1) -> None:
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = min(self.max_rate, self.rate * factor)
+
+
+class PaapiTiming(NamedTuple):
+    """Wall time of one GetItems call; status is None when no response came back."""
+
+    asins: int
+    status: Optional[int]
+    seconds: float
+
+
+class PaapiClient:
+    """
+    Reusable PA-API GetItems client.
+
+    Credentials are read once, requests share a keep-alive session with a
+    sized connection pool, and derived SigV4 signing keys are cached per
+    date/region/service. Each call's wall time is kept in ``timings``.
+    """
+
+    def __init__(
+        self,
+        access_key: Optional[str] = None,
+        secret_key: Optional[str] = None,
+        partner_tag: Optional[str] = None,
+        region: Optional[str] = None,
+        host: Optional[str] = None,
+        scheme: Optional[str] = None,
+        pool_size: int = 10,
+        timeout: float = 10,
+    ):
+        self.access_key = access_key or _get_env("AMAZON_PAAPI_ACCESS_KEY")
+        self.secret_key = secret_key or _get_env("AMAZON_PAAPI_SECRET_KEY")
+        self.partner_tag = partner_tag or _get_env("AMAZON_PAAPI_PARTNER_TAG")
+        self.region = region or _get_env("AMAZON_PAAPI_REGION") or "us-east-1"
+        self.host = (
+            host
+            or _get_env("AMAZON_PAAPI_HOST")
+            or PAAPI_HOSTS.get(self.region, PAAPI_HOSTS["us-east-1"])
         )
+        # AMAZON_PAAPI_SCHEME=http with AMAZON_PAAPI_HOST=localhost:8765 talks to the paapi_stub command
+        self.scheme = scheme or _get_env("AMAZON_PAAPI_SCHEME") or "https"
+        self.endpoint = f"{self.scheme}://{self.host}{PAAPI_PATH}"
+        self.marketplace = _marketplace_for_host(self.host)
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.timings = deque(maxlen=1000)
+        self._signing_keys: Dict[tuple, bytes] = {}
+        self._session = None
+        self._lock = threading.Lock()
 
-    if not (access_key and secret_key and partner_tag):
-        if verbose:
-            print("PA-API missing required credentials; skipping fetch")
-        return None
+    @property
+    def configured(self) -> bool:
+        return bool(self.access_key and self.secret_key and self.partner_tag)
 
-    host_override = _get_env("AMAZON_PAAPI_HOST")
-    host = host_override or PAAPI_HOSTS.get(region, PAAPI_HOSTS["us-east-1"])
-    endpoint = f"https://{host}/paapi5/getitems"
-
-    amz_date = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
-    date_stamp = datetime.datetime.utcnow().strftime("%Y%m%d")
-
-    marketplace = _marketplace_for_host(host)
-    payload = _build_getitems_payload(asin, partner_tag, marketplace, title_only=title_only)
-    payload_json = json.dumps(payload)
-
-    service = "ProductAdvertisingAPI"
-    method = "POST"
-    canonical_uri = "/paapi5/getitems"
-    canonical_querystring = ""
-    content_type = "application/json; charset=UTF-8"
-    target = "com.amazon.paapi5.v1.ProductAdvertisingAPIv1.GetItems"
-    payload_hash = hashlib.sha256(payload_json.encode("utf-8")).hexdigest()
-    canonical_headers = (
-        f"content-encoding:amz-1.0\n"
-        f"content-type:{content_type}\n"
-        f"host:{host}\n"
-        f"x-amz-content-sha256:{payload_hash}\n"
-        f"x-amz-date:{amz_date}\n"
-        f"x-amz-target:{target}\n"
-    )
-    signed_headers = "content-encoding;content-type;host;x-amz-content-sha256;x-amz-date;x-amz-target"
-    canonical_request = (
-        f"{method}\n{canonical_uri}\n{canonical_querystring}\n{canonical_headers}\n{signed_headers}\n{payload_hash}"
-    )
-
-    algorithm = "AWS4-HMAC-SHA256"
-    credential_scope = f"{date_stamp}/{region}/{service}/aws4_request"
-    string_to_sign = (
-        f"{algorithm}\n{amz_date}\n{credential_scope}\n"
-        + hashlib.sha256(canonical_request.encode("utf-8")).hexdigest()
-    )
-
-    signing_key = _get_signature_key(secret_key, date_stamp, region, service)
-    signature = hmac.new(signing_key, string_to_sign.encode("utf-8"), hashlib.sha256).hexdigest()
-
-    authorization_header = (
-        f"{algorithm} Credential={access_key}/{credential_scope}, SignedHeaders={signed_headers}, Signature={signature}"
-    )
-
-    headers = {
-        "content-encoding": "amz-1.0",
-        "content-type": content_type,
-        "host": host,
-        "x-amz-date": amz_date,
-        "x-amz-target": target,
-        "x-amz-content-sha256": payload_hash,
-        "accept": "application/json",
-        "user-agent": "wtsr-paapi/1.0 (https://wheretostartreading.com)",
-        "Authorization": authorization_header,
-    }
+    @property
+    def session(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    import requests  # type: ignore
+                    from requests.adapters import HTTPAdapter  # type: ignore
+
+                    session = requests.Session()
+                    session.mount(
+                        f"{self.scheme}://",
+                        HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size),
+                    )
+                    self._session = session
+        return self._session
+
+    @property
+    def last_timing(self) -> Optional[PaapiTiming]:
+        return self.timings[-1] if self.timings else None
+
+    def signing_key(self, date_stamp: str) -> bytes:
+        cache_key = (date_stamp, self.region, PAAPI_SERVICE)
+        key = self._signing_keys.get(cache_key)
+        if key is None:
+            key = _get_signature_key(self.secret_key, date_stamp, self.region, PAAPI_SERVICE)
+            # Only today's (and maybe yesterday's) key is ever needed
+            if len(self._signing_keys) > 4:
+                self._signing_keys.clear()
+            self._signing_keys[cache_key] = key
+        return key
 
-    if verbose:
-        print(
-            f"PA-API request: endpoint={endpoint}, marketplace={marketplace}, partner_tag={partner_tag}, asin={asin}, title_only={title_only}"
+    def signed_headers(self, payload_json: str, verbose: bool = False) -> Dict[str, str]:
+        now = datetime.datetime.utcnow()
+        amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+        date_stamp = now.strftime("%Y%m%d")
+
+        method = "POST"
+        canonical_querystring = ""
+        content_type = "application/json; charset=UTF-8"
+        payload_hash = hashlib.sha256(payload_json.encode("utf-8")).hexdigest()
+        canonical_headers = (
+            f"content-encoding:amz-1.0\n"
+            f"content-type:{content_type}\n"
+            f"host:{self.host}\n"
+            f"x-amz-content-sha256:{payload_hash}\n"
+            f"x-amz-date:{amz_date}\n"
+            f"x-amz-target:{PAAPI_TARGET}\n"
         )
-        # Safe to print meta (no secrets)
-        print(f"PA-API signed headers: {signed_headers}")
-        print(
-            f"PA-API canonical_request SHA256: {hashlib.sha256(canonical_request.encode('utf-8')).hexdigest()}"
+        signed_headers = "content-encoding;content-type;host;x-amz-content-sha256;x-amz-date;x-amz-target"
+        canonical_request = (
+            f"{method}\n{PAAPI_PATH}\n{canonical_querystring}\n{canonical_headers}\n{signed_headers}\n{payload_hash}"
         )
 
-    try:
-        resp = requests.post(endpoint, data=payload_json, headers=headers, timeout=10)
-        if resp.status_code != 200:
-            if verbose:
-                try:
-                    body = resp.text[:800]
-                except Exception:
-                    body = "<unreadable>"
-                print(f"PA-API HTTP {resp.status_code} for {asin}: {body}")
-                # As a diagnostic, try a title-only request to confirm item is accessible
-                if not title_only:
-                    print("PA-API attempting title-only diagnostic fetch...")
-                    diag = fetch_paapi_images(asin, verbose=verbose, title_only=True)
-                    if diag:
-                        print("PA-API title-only fetch succeeded (images still unavailable).")
-            return None
-        data = resp.json()
-        if "Errors" in data and verbose:
-            print(f"PA-API Errors for {asin}: {data.get('Errors')}")
-        items = data.get("ItemsResult", {}).get("Items", [])
-        if not items:
-            if verbose:
-                print(f"PA-API returned no items for {asin}. Raw: {data}")
-            return None
-        item = items[0]
-        title = item.get("ItemInfo", {}).get("Title", {}).get("DisplayValue")
-        images = item.get("Images", {}).get("Primary", {}) if not title_only else {}
-        medium = images.get("Medium", {}).get("URL") if images else None
-        large = images.get("Large", {}).get("URL") if images else None
-        if not title_only and not (medium or large):
-            if verbose:
-                print(f"PA-API item missing image URLs for {asin}. Item: {item}")
-            return None
+        algorithm = "AWS4-HMAC-SHA256"
+        credential_scope = f"{date_stamp}/{self.region}/{PAAPI_SERVICE}/aws4_request"
+        string_to_sign = (
+            f"{algorithm}\n{amz_date}\n{credential_scope}\n"
+            + hashlib.sha256(canonical_request.encode("utf-8")).hexdigest()
+        )
+
+        signature = hmac.new(
+            self.signing_key(date_stamp), string_to_sign.encode("utf-8"), hashlib.sha256
+        ).hexdigest()
+
+        authorization_header = (
+            f"{algorithm} Credential={self.access_key}/{credential_scope}, SignedHeaders={signed_headers}, Signature={signature}"
+        )
+
+        if verbose:
+            # Safe to print meta (no secrets)
+            print(f"PA-API signed headers: {signed_headers}")
+            print(
+                f"PA-API canonical_request SHA256: {hashlib.sha256(canonical_request.encode('utf-8')).hexdigest()}"
+            )
+
         return {
-            "title": title,
-            "image_url": (medium or large) if not title_only else None,
-            "image_url_2x": (large or medium) if not title_only else None,
+            "content-encoding": "amz-1.0",
+            "content-type": content_type,
+            "host": self.host,
+            "x-amz-date": amz_date,
+            "x-amz-target": PAAPI_TARGET,
+            "x-amz-content-sha256": payload_hash,
+            "accept": "application/json",
+            "user-agent": "wtsr-paapi/1.0 (https://wheretostartreading.com)",
+            "Authorization": authorization_header,
         }
-    except Exception as e:
+
+    def get_items_many(
+        self, asins: List[str], verbose: bool = False, title_only: bool = False
+    ) -> Dict[str, Optional[Dict[str, str]]]:
+        """
+        Fetch many ASINs with one GetItems call per PAAPI_MAX_ITEM_IDS.
+
+        ASINs Amazon answered without usable images map to None; ASINs whose
+        call failed are left out so callers retry them instead of recording a
+        miss. Raises PaapiThrottled if Amazon throttles any of the calls.
+        """
+        asins = list(dict.fromkeys(asins))
+        results: Dict[str, Optional[Dict[str, str]]] = {}
+        for i in range(0, len(asins), PAAPI_MAX_ITEM_IDS):
+            chunk = asins[i:i + PAAPI_MAX_ITEM_IDS]
+            results.update(self.get_items(chunk, verbose=verbose, title_only=title_only))
+        return results
+
+    def get_items(
+        self, asins: List[str], verbose: bool = False, title_only: bool = False
+    ) -> Dict[str, Optional[Dict[str, str]]]:
+        """
+        One GetItems call for up to PAAPI_MAX_ITEM_IDS ASINs; raises PaapiThrottled on 429.
+
+        Returns an empty dict when the call fails (no credentials, HTTP error,
+        timeout), since that says nothing about the items themselves.
+        """
+        results: Dict[str, Optional[Dict[str, str]]] = {}
+        label = ",".join(asins)
+
         if verbose:
-            print(f"PA-API exception for {asin}: {e}")
-        return None
+            print(
+                "PA-API env: ACCESS_KEY=%s, SECRET_KEY=%s, PARTNER_TAG=%s, REGION=%s"
+                % (
+                    "set" if self.access_key else "missing",
+                    "set" if self.secret_key else "missing",
+                    self.partner_tag or "missing",
+                    self.region,
+                )
+            )
+
+        if not self.configured:
+            if verbose:
+                print("PA-API missing required credentials; skipping fetch")
+            return results
+
+        # Lazy import to avoid hard failure if requests isn't installed yet
+        try:
+            session = self.session
+        except Exception:
+            return results
+
+        payload = _build_getitems_payload(asins, self.partner_tag, self.marketplace, title_only=title_only)
+        payload_json = json.dumps(payload)
+
+        if verbose:
+            print(
+                f"PA-API request: endpoint={self.endpoint}, marketplace={self.marketplace}, partner_tag={self.partner_tag}, asins={label}, title_only={title_only}"
+            )
+        headers = self.signed_headers(payload_json, verbose=verbose)
+
+        status = None
+        started = time.monotonic()
+        try:
+            resp = session.post(self.endpoint, data=payload_json, headers=headers, timeout=self.timeout)
+            status = resp.status_code
+            if resp.status_code == 429:
+                raise PaapiThrottled(f"PA-API HTTP 429 for {label}")
+            if resp.status_code != 200:
+                if verbose:
+                    try:
+                        body = resp.text[:800]
+                    except Exception:
+                        body = "<unreadable>"
+                    print(f"PA-API HTTP {resp.status_code} for {label}: {body}")
+                    # As a diagnostic, try a title-only request to confirm items are accessible
+                    if not title_only:
+                        print("PA-API attempting title-only diagnostic fetch...")
+                        diag = self.get_items(asins, verbose=verbose, title_only=True)
+                        if any(diag.values()):
+                            print("PA-API title-only fetch succeeded (images still unavailable).")
+                return results
+            data = resp.json()
+            # Amazon answered: every ASIN is now a hit or a per-item miss
+            results = {asin: None for asin in asins}
+            for error in data.get("Errors", []):
+                asin = _error_asin(error, asins)
+                if verbose:
+                    print(f"PA-API Error for {asin or label}: {error.get('Code')}: {error.get('Message')}")
+            items = data.get("ItemsResult", {}).get("Items", [])
+            if not items and any(e.get("Code") == "TooManyRequests" for e in data.get("Errors", [])):
+                raise PaapiThrottled(f"PA-API TooManyRequests for {label}")
+            if not items:
+                if verbose:
+                    print(f"PA-API returned no items for {label}. Raw: {data}")
+                return results
+            for item in items:
+                asin = item.get("ASIN")
+                if asin not in results and len(asins) == 1:
+                    # A lone item answers a lone request even if Amazon canonicalised the ASIN
+                    asin = asins[0]
+                if asin not in results:
+                    continue
+                parsed = _parse_item(item, title_only=title_only)
+                if parsed is None and verbose:
+                    print(f"PA-API item missing image URLs for {asin}. Item: {item}")
+                results[asin] = parsed
+            if verbose:
+                for asin, parsed in results.items():
+                    if parsed is None:
+                        print(f"PA-API miss for {asin}")
+            return results
+        except PaapiThrottled:
+            if verbose:
+                print(f"PA-API throttled for {label}")
+            raise
+        except Exception as e:
+            if verbose:
+                print(f"PA-API exception for {label}: {e}")
+            return results
+        finally:
+            elapsed = time.monotonic() - started
+            self.timings.append(PaapiTiming(len(asins), status, elapsed))
+            timing.record("paapi", elapsed)
+            metrics.paapi_requests.inc("none" if status is None else status)
+            metrics.paapi_request_seconds.observe(elapsed)
+            if verbose:
+                print(f"PA-API call for {label} took {elapsed * 1000:.0f}ms (HTTP {status})")
+
+
+_client: Optional[PaapiClient] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> PaapiClient:
+    """Process-wide PaapiClient, created on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = PaapiClient()
+    return _client
+
+
+def fetch_paapi_images(asin: str, verbose: bool = False, title_only: bool = False) -> Optional[Dict[str, str]]:
+    return get_client().get_items([asin], verbose=verbose, title_only=title_only).get(asin)
+
+
+def fetch_paapi_images_many(
+    asins: List[str], verbose: bool = False, title_only: bool = False
+) -> Dict[str, Optional[Dict[str, str]]]:
+    return get_client().get_items_many(asins, verbose=verbose, title_only=title_only)
@@ -0,0 +1,168 @@
+"""
+Generational cache namespaces.
+
+Rather than deleting or flushing, invalidation bumps a counter and every key
+built from it moves to a new name; the old entries are never read again and
+age out of memcached through LRU. There is a counter for the whole site, one
+for the article navigation every page shows, one per cached page path and one
+per ASIN.
+
+ASIN image tuples are also kept in a small per-process LRU (asin_images_local)
+in front of the shared cache, emptied whenever any ASIN's images change.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import cache
+
+from . import timing
+
+
+def _generation_key(scope):
+    return f"gen:{scope}"
+
+
+def _seed():
+    # Counters lost to eviction restart from the clock, never from a number
+    # that older entries may still be stored under.
+    return int(time.time() * 1000)
+
+
+def get_generations(scopes):
+    """Current generation of each scope, with one cache round trip."""
+    keys = {_generation_key(scope): scope for scope in scopes}
+    with timing.timed("cache"):
+        found = cache.get_many(keys)
+    generations = {}
+    for key, scope in keys.items():
+        if key not in found:
+            seed = _seed()
+            if not cache.add(key, seed, None):
+                seed = cache.get(key, seed)
+            found[key] = seed
+        generations[scope] = found[key]
+    return generations
+
+
+def bump_generations(scopes):
+    for scope in scopes:
+        key = _generation_key(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            if not cache.add(key, _seed(), None):
+                cache.incr(key)
+
+
+def page_scope(path):
+    return "page:" + hashlib.md5(path.encode("utf-8")).hexdigest()
+
+
+def asin_scope(asin):
+    return f"asin:{asin}"
+
+
+def page_key_prefix(key_prefix, path):
+    """CACHE_MIDDLEWARE_KEY_PREFIX extended with the site, nav and page generations."""
+    scope = page_scope(path)
+    generations = get_generations(["site", "nav", scope])
+    return f"{key_prefix}.{generations['site']}.{generations['nav']}.{generations[scope]}"
+
+
+def navigation_key():
+    generations = get_generations(["site", "nav"])
+    return f"article-nav:{generations['site']}.{generations['nav']}"
+
+
+def asin_images_keys(asins):
+    """Map each ASIN to its current asin-images cache key."""
+    asins = list(asins)
+    generations = get_generations(["site"] + [asin_scope(asin) for asin in asins])
+    site = generations["site"]
+    return {
+        asin: f"asin-images:{asin}:{site}.{generations[asin_scope(asin)]}"
+        for asin in asins
+    }
+
+
+def evict_pages(paths):
+    bump_generations([page_scope(path) for path in paths])
+
+
+def evict_navigation():
+    """Invalidate the article navigation, and with it every cached page."""
+    bump_generations(["nav"])
+
+
+def evict_asin_images(asins):
+    bump_generations([asin_scope(asin) for asin in asins] + [asin_images_local.scope])
+    asin_images_local.clear()
+
+
+def evict_site():
+    """Invalidate every page and asin-images entry at once."""
+    bump_generations(["site", asin_images_local.scope])
+    asin_images_local.clear()
+
+
+class LocalCache:
+    """
+    Bounded in-process LRU with a TTL. Other processes invalidate it by
+    bumping the generation of its scope, which is read at most once every
+    check_interval seconds; a moved generation empties the whole cache.
+    """
+
+    def __init__(self, scope, maxsize=1000, ttl=60, check_interval=1.0):
+        self.scope = scope
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.generation = None
+        self.checked_at = None
+
+    def _check_generation(self):
+        now = time.monotonic()
+        if self.checked_at is not None and now - self.checked_at < self.check_interval:
+            return
+        generation = get_generations([self.scope])[self.scope]
+        with self.lock:
+            if generation != self.generation:
+                self.entries.clear()
+                self.generation = generation
+            self.checked_at = now
+
+    def get_many(self, keys):
+        self._check_generation()
+        now = time.monotonic()
+        found = {}
+        with self.lock:
+            for key in keys:
+                entry = self.entries.get(key)
+                if entry is not None and entry[1] > now:
+                    self.entries.move_to_end(key)
+                    found[key] = entry[0]
+                elif entry is not None:
+                    del self.entries[key]
+        return found
+
+    def set_many(self, mapping):
+        expires = time.monotonic() + self.ttl
+        with self.lock:
+            for key, value in mapping.items():
+                self.entries[key] = (value, expires)
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            # Pick up the new generation on the next lookup
+            self.checked_at = None
+
+
+asin_images_local = LocalCache("asin-images-local")
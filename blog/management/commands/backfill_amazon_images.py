@@ -1,15 +1,23 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 from django.core.management.base import BaseCommand
 from django.db import transaction
 from django.db.models import Q, F
 from django.utils import timezone
-import re
+import time
 
-from blog.models import Article, RE_ASIN, get_asin_image_urls, _store_asin_images, AmazonProduct
-from blog import amazon_api
+from blog.models import (
+    ArticleAsin,
+    AmazonProduct,
+    BackfillCheckpoint,
+    _get_cached_asin_images_many,
+    _store_asin_images_many,
+)
+from blog import amazon_api, metrics
 
 
 class Command(BaseCommand):
-    help = "Backfill Amazon product images by scanning articles for ASINs and fetching via PA-API"
+    help = "Backfill Amazon product images for the ASINs articles reference, fetching via PA-API"
 
     def add_arguments(self, parser):
         parser.add_argument("--refetch", action="store_true", help="Force refetch even if cached recently")
@@ -21,7 +29,7 @@ class Command(BaseCommand):
         parser.add_argument(
             "--products",
             action="store_true",
-            help="Process AmazonProduct rows missing images instead of scanning articles",
+            help="Process AmazonProduct rows missing images instead of indexed article ASINs",
         )
         parser.add_argument(
             "--sleep",
@@ -29,87 +37,259 @@ class Command(BaseCommand):
             default=0.0,
             help="Optional sleep in seconds between API calls to respect rate limits",
         )
+        parser.add_argument(
+            "--workers", type=int, default=1, help="Number of threads fetching from PA-API in parallel"
+        )
+        parser.add_argument(
+            "--rate",
+            type=float,
+            default=None,
+            help="Token-bucket limit in PA-API requests per second (default 1.0 with --workers > 1)",
+        )
+        parser.add_argument("--burst", type=int, default=1, help="Requests the token bucket may bank")
+        parser.add_argument(
+            "--max-retries", type=int, default=5, help="Retries per batch after PA-API throttling or errors"
+        )
+        parser.add_argument(
+            "--commit-every",
+            type=int,
+            default=50,
+            help="Commit stored results and the checkpoint after this many ASINs",
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Continue the last interrupted run from its checkpoint",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            default=None,
+            help="Checkpoint name (defaults to 'products' or 'articles' by mode)",
+        )
 
-    @transaction.atomic
     def handle(self, *args, **options):
-        qs = Article.objects.all()
-        since_days = options.get("since_days")
-        if since_days:
-            since = timezone.now() - timezone.timedelta(days=since_days)
-            qs = qs.filter(modified_at__gte=since)
-
-        count = 0
-        processed = 0
-        found = set()
         limit = options.get("limit")
-        verbose = options.get("verbose", False)
+        name = options.get("checkpoint") or ("products" if options.get("products") else "articles")
+        checkpoint, _ = BackfillCheckpoint.objects.get_or_create(name=name)
+
+        if options.get("resume"):
+            if checkpoint.finished_at:
+                self.stdout.write(self.style.SUCCESS(f"Checkpoint '{name}' already finished; nothing to resume."))
+                return
+            cursor = checkpoint.cursor
+            self.stdout.write(f"Resuming '{name}' after {cursor or 'the start'}.")
+        else:
+            cursor = None
+            checkpoint.cursor = None
+            checkpoint.processed = 0
+            checkpoint.updated = 0
+            checkpoint.started_at = timezone.now()
+            checkpoint.finished_at = None
+            self.save_checkpoint(checkpoint)
+        self.checkpoint = checkpoint
 
         # If requested, process AmazonProduct rows missing images in least-recently-fetched order
         if options.get("products"):
             limit = limit or 10
-            to_fetch = AmazonProduct.objects.filter(Q(image_url__isnull=True) | Q(image_url="")).order_by(
-                F("last_fetched_at").asc(nulls_first=True)
-            )[:limit]
-            for ap in to_fetch:
-                asin = ap.asin
-                fetched = amazon_api.fetch_paapi_images(asin, verbose=verbose)
-                if fetched:
-                    _store_asin_images(
-                        asin,
-                        fetched.get("image_url"),
-                        fetched.get("image_url_2x"),
-                        fetched.get("title"),
-                        status="ok",
-                    )
+            to_fetch = AmazonProduct.objects.filter(Q(image_url__isnull=True) | Q(image_url=""))
+            if not options.get("refetch"):
+                # Known misses wait for their retry time
+                to_fetch = to_fetch.filter(Q(next_retry_at__isnull=True) | Q(next_retry_at__lte=timezone.now()))
+            if cursor:
+                to_fetch = to_fetch.filter(asin__gt=cursor)
+            # The least-recently-fetched rows are chosen, then sorted for the cursor;
+            # one more than the limit shows whether any were left over
+            to_fetch = list(
+                to_fetch.order_by(F("last_fetched_at").asc(nulls_first=True)).values_list("asin", flat=True)[
+                    : limit + 1
+                ]
+            )
+            truncated = len(to_fetch) > limit
+            to_fetch = sorted(to_fetch[:limit])
+            count = self.fetch(to_fetch, options)
+            self.finish(truncated)
+            self.stdout.write(self.style.SUCCESS(f"Done. Updated {count} ASINs. Processed {len(to_fetch)}."))
+            return
+
+        qs = ArticleAsin.objects.all()
+        since_days = options.get("since_days")
+        if since_days:
+            since = timezone.now() - timezone.timedelta(days=since_days)
+            qs = qs.filter(article__modified_at__gte=since)
+        if cursor:
+            qs = qs.filter(asin__gt=cursor)
+
+        # Sorted so the checkpoint cursor means "everything up to here is done"
+        asins = list(qs.order_by("asin").values_list("asin", flat=True).distinct())
+        truncated = bool(limit) and len(asins) > limit
+        if truncated:
+            asins = asins[:limit]
+            self.stdout.write(self.style.SUCCESS("Reached --limit; stopping."))
+
+        count = 0
+        to_fetch = asins
+        if not options.get("refetch"):
+            cached = _get_cached_asin_images_many(asins)
+            for asin in asins:
+                if cached.get(asin):
                     count += 1
                     self.stdout.write(self.style.SUCCESS(f"Cached images for {asin}"))
-                else:
-                    self.stdout.write(self.style.WARNING(f"No images for {asin}"))
-                processed += 1
-                if options.get("sleep", 0):
-                    import time
+                elif asin in cached:
+                    self.stdout.write(f"Skipping {asin}; no images until its retry is due")
+            to_fetch = [asin for asin in asins if asin not in cached]
+
+        count += self.fetch(to_fetch, options)
+        self.finish(truncated)
+        self.stdout.write(self.style.SUCCESS(f"Done. Updated {count} ASINs. Processed {len(asins)}."))
+
+    def save_checkpoint(self, checkpoint):
+        # update() rather than save() so progress does not fire post_save receivers
+        BackfillCheckpoint.objects.filter(pk=checkpoint.pk).update(
+            cursor=checkpoint.cursor,
+            processed=checkpoint.processed,
+            updated=checkpoint.updated,
+            started_at=checkpoint.started_at,
+            finished_at=checkpoint.finished_at,
+        )
+
+    def finish(self, truncated=False):
+        """Mark the checkpoint finished unless failed batches or --limit left ASINs behind."""
+        if self.stalled:
+            self.stdout.write(
+                self.style.WARNING("Some batches were throttled or failed; run again with --resume to retry them.")
+            )
+            return
+        if truncated:
+            self.stdout.write("Stopped at --limit; run again with --resume to continue.")
+            return
+        self.checkpoint.finished_at = timezone.now()
+        self.save_checkpoint(self.checkpoint)
 
+    def fetch(self, asins, options):
+        """Fetch ASINs in GetItems-sized batches; returns how many got images."""
+        workers = max(1, options.get("workers") or 1)
+        rate = options.get("rate")
+        if rate is None and workers > 1:
+            rate = 1.0
+        limiter = amazon_api.TokenBucket(rate, burst=options.get("burst") or 1) if rate else None
+
+        batches = [
+            asins[i:i + amazon_api.PAAPI_MAX_ITEM_IDS]
+            for i in range(0, len(asins), amazon_api.PAAPI_MAX_ITEM_IDS)
+        ]
+        self.commit_every = max(1, options.get("commit_every") or 1)
+        self.pending = {}
+        self.next_batch = 0
+        self.stalled = False
+        self.count = 0
+        self.progress_total = len(asins)
+        self.progress_done = 0
+        self.progress_started = time.monotonic()
+
+        if workers == 1:
+            for i, batch in enumerate(batches):
+                self.collect(batches, i, self.fetch_batch(batch, limiter, options))
+                if options.get("sleep", 0):
                     time.sleep(options["sleep"])
+        else:
+            # Threads only talk to PA-API; results are stored from this thread
+            pool = ThreadPoolExecutor(max_workers=workers)
+            try:
+                futures = {
+                    pool.submit(self.fetch_batch, batch, limiter, options): i for i, batch in enumerate(batches)
+                }
+                for future in as_completed(futures):
+                    self.collect(batches, futures[future], future.result())
+            except BaseException:
+                # Ctrl-C: drop queued batches; everything committed so far is kept
+                pool.shutdown(wait=False, cancel_futures=True)
+                raise
+            pool.shutdown()
+
+        self.commit(batches)
+        metrics.flush()
+        return self.count
+
+    def fetch_batch(self, batch, limiter, options):
+        """
+        Fetch one batch, backing off on throttling and failed calls; returns
+        None if it never gets through.
+        """
+        delay = 1.0
+        for attempt in range(options.get("max_retries", 5) + 1):
+            if limiter:
+                limiter.acquire()
+            try:
+                fetched = amazon_api.fetch_paapi_images_many(batch, verbose=options.get("verbose", False))
+            except amazon_api.PaapiThrottled:
+                if limiter:
+                    limiter.backoff()
+                time.sleep(delay)
+                delay *= 2
+                continue
+            if any(asin not in fetched for asin in batch):
+                # A failed call answers nothing; storing it would record misses
+                time.sleep(delay)
+                delay *= 2
+                continue
+            if limiter:
+                limiter.recover()
+            return fetched
+        return None
+
+    def collect(self, batches, index, fetched):
+        batch = batches[index]
+        if fetched is None:
+            metrics.backfill_asins.inc("gave_up", len(batch))
+            self.stdout.write(self.style.ERROR(f"Gave up after repeated throttling or errors: {', '.join(batch)}"))
+        self.pending[index] = fetched
 
-            self.stdout.write(self.style.SUCCESS(f"Done. Updated {count} ASINs. Processed {processed}."))
+        self.progress_done += len(batch)
+        elapsed = time.monotonic() - self.progress_started
+        throughput = self.progress_done / elapsed if elapsed else 0.0
+        remaining = self.progress_total - self.progress_done
+        eta = remaining / throughput if throughput else 0.0
+        self.stdout.write(
+            f"Progress: {self.progress_done}/{self.progress_total} ASINs, "
+            f"{throughput:.1f} ASINs/s, ETA {eta:.0f}s"
+        )
+
+        if sum(len(batches[i]) for i in self.pending) >= self.commit_every:
+            self.commit(batches)
+
+    def commit(self, batches):
+        """
+        Store the contiguous run of finished batches and move the checkpoint past
+        them in one transaction. Batches finishing out of order wait for the gap.
+        A batch that never got through stops the cursor so --resume retries it.
+        """
+        ready = []
+        while self.next_batch in self.pending:
+            ready.append(self.next_batch)
+            self.next_batch += 1
+        if not ready:
             return
 
-        for article in qs.iterator():
-            for m in RE_ASIN.finditer(article.content or ""):
-                asin = m.group(1)
-                if asin in found:
-                    continue
-                found.add(asin)
-
-                if limit and processed >= limit:
-                    self.stdout.write(self.style.SUCCESS("Reached --limit; stopping."))
-                    self.stdout.flush()
-                    self.stdout.write(
-                        self.style.SUCCESS(f"Done. Updated {count} ASINs. Processed {processed}.")
-                    )
-                    return
-
-                if options.get("refetch"):
-                    fetched = amazon_api.fetch_paapi_images(asin, verbose=verbose)
-                    if fetched:
-                        _store_asin_images(
-                            asin,
-                            fetched.get("image_url"),
-                            fetched.get("image_url_2x"),
-                            fetched.get("title"),
-                            status="ok",
-                        )
-                        res = True
-                    else:
-                        res = False
-                else:
-                    res = get_asin_image_urls(asin)
+        checkpoint = self.checkpoint
+        combined = {}
+        for index in ready:
+            fetched = self.pending.pop(index)
+            if fetched is None:
+                self.stalled = True
+                continue
+            combined.update(fetched)
+            checkpoint.processed += len(batches[index])
+            if not self.stalled:
+                checkpoint.cursor = batches[index][-1]
 
+        # One bulk upsert and one invalidation per commit
+        with transaction.atomic():
+            for asin, res in _store_asin_images_many(combined).items():
                 if res:
-                    count += 1
+                    self.count += 1
+                    checkpoint.updated += 1
                     self.stdout.write(self.style.SUCCESS(f"Cached images for {asin}"))
                 else:
                     self.stdout.write(self.style.WARNING(f"No images for {asin}"))
-                processed += 1
-
-        self.stdout.write(self.style.SUCCESS(f"Done. Updated {count} ASINs. Processed {processed}."))
+                metrics.backfill_asins.inc("updated" if res else "no_images")
+            self.save_checkpoint(checkpoint)
@@ -0,0 +1,296 @@
+import json
+import os
+import statistics
+import string
+import time
+import tracemalloc
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from blog import amazon_api, views
+from blog.caching import asin_images_local
+from blog.models import (
+    AmazonProduct,
+    Article,
+    compile_asin_markup,
+    process_asin_thumbnails,
+)
+
+BENCHMARK_CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "benchmark-render",
+    }
+}
+
+
+class Rollback(Exception):
+    """Raised to undo everything the benchmark wrote."""
+
+
+def synthetic_asin(n):
+    # A prefix real ASINs do not use, so existing AmazonProduct rows never interfere
+    return "BZ{:08d}".format(n)
+
+
+def synthetic_slug(n):
+    # The article URL pattern only routes letters and dashes
+    letters = ""
+    n += 1
+    while n:
+        n, r = divmod(n - 1, 26)
+        letters = string.ascii_lowercase[r] + letters
+    return "bench-" + letters
+
+
+def synthetic_content(n, asins, asinps, links):
+    """An article body with the given number of ASIN, ASINP and link lines"""
+    lines = ["Where to start with benchmark series {} and @startcomics.".format(n), ""]
+    asin = n * 1000
+    for i in range(asins):
+        lines.append("ASIN {} Volume {}".format(synthetic_asin(asin + i), i + 1))
+        if i % 6 == 5:
+            lines.append("")
+            lines.append("Between the volumes, read ASIN {} next.".format(synthetic_asin(asin + i)))
+            lines.append("")
+    lines.append("")
+    for i in range(asinps):
+        lines.append(
+            "<ASINP {} Cover {}> Paragraph about volume {} with **bold** text.".format(
+                synthetic_asin(asin + 500 + i), i, i
+            )
+        )
+        lines.append("")
+    for i in range(links):
+        lines.append("* [Link {}](https://example.com/{}/{}) and <a href='http://example.org'>x</a>".format(i, n, i))
+    return "\n".join(lines)
+
+
+def fake_paapi_item(asin):
+    return {
+        "title": "Benchmark " + asin,
+        "image_url": "https://images.example.com/{}.jpg".format(asin),
+        "image_url_2x": "https://images.example.com/{}_2x.jpg".format(asin),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the markup pipeline and listing/article views on synthetic articles, "
+        "comparing against a baseline file. Nothing is left in the database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--articles", type=int, default=20, help="Synthetic articles to create")
+        parser.add_argument("--asins", type=int, default=30, help="ASIN lines per article")
+        parser.add_argument("--asinps", type=int, default=5, help="ASINP lines per article")
+        parser.add_argument("--links", type=int, default=10, help="Link lines per article")
+        parser.add_argument("--iterations", type=int, default=5, help="Timed runs of each stage")
+        parser.add_argument(
+            "--baseline",
+            default="benchmark_render.json",
+            help="Baseline file to compare against (and write with --save-baseline)",
+        )
+        parser.add_argument("--save-baseline", action="store_true", help="Write this run as the new baseline")
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=1.25,
+            help="Flag stages slower or bigger than baseline by more than this factor",
+        )
+        parser.add_argument(
+            "--check", action="store_true", help="Exit with an error if any stage regressed against the baseline"
+        )
+
+    def handle(self, *args, **options):
+        with override_settings(CACHES=BENCHMARK_CACHES), mock.patch.object(
+            amazon_api, "fetch_paapi_images", side_effect=fake_paapi_item
+        ), mock.patch.object(
+            amazon_api,
+            "fetch_paapi_images_many",
+            side_effect=lambda asins, **kwargs: {asin: fake_paapi_item(asin) for asin in asins},
+        ):
+            try:
+                with transaction.atomic():
+                    results = self.run(options)
+                    raise Rollback
+            except Rollback:
+                pass
+        asin_images_local.clear()
+
+        self.report(results, options)
+
+    def run(self, options):
+        self.stdout.write("Creating {} synthetic articles...".format(options["articles"]))
+        now = timezone.now()
+        contents = [
+            synthetic_content(n, options["asins"], options["asinps"], options["links"])
+            for n in range(options["articles"])
+        ]
+        # Every synthetic ASIN has stored images, as on the live site, before
+        # saving articles would queue them for fetching
+        AmazonProduct.objects.bulk_create(
+            [
+                AmazonProduct(asin=asin, last_fetched_at=now, fetch_status="ok", **fake_paapi_item(asin))
+                for asin in {
+                    synthetic_asin(n * 1000 + i)
+                    for n in range(options["articles"])
+                    for i in list(range(options["asins"])) + [500 + i for i in range(options["asinps"])]
+                }
+            ],
+            ignore_conflicts=True,
+        )
+        articles = []
+        for n, content in enumerate(contents):
+            articles.append(
+                Article.objects.create(
+                    title="Benchmark article {}".format(n),
+                    title_short="Benchmark {}".format(n),
+                    slug=synthetic_slug(n),
+                    description="Synthetic article {}".format(n),
+                    content=content,
+                    markup="html" if n % 4 == 3 else "markdown",
+                    featured=n % 5 == 0,
+                    published_at=now - timezone.timedelta(days=n),
+                )
+            )
+
+        factory = RequestFactory(HTTP_HOST="wheretostartreading.com")
+        slugs = [article.slug for article in articles]
+
+        def fresh_articles():
+            return list(Article.objects.filter(slug__in=slugs))
+
+        def render_cold():
+            cache.clear()
+            asin_images_local.clear()
+            for article in fresh_articles():
+                article.render_content_html()
+
+        def render_warm():
+            for article in fresh_articles():
+                article.render_content_html()
+
+        def content_html_stored():
+            for article in fresh_articles():
+                article.content_html
+
+        def legacy_thumbnails():
+            for content in contents:
+                process_asin_thumbnails(content)
+
+        def single_pass_markup():
+            for content in contents:
+                compile_asin_markup(content.split("\n"))
+
+        def view(func, *args, **kwargs):
+            def run():
+                response = func(factory.get("/", secure=True), *args, **kwargs)
+                assert response.status_code == 200, response.status_code
+
+            return run
+
+        def article_views():
+            for slug in slugs:
+                view(views.article, slug=slug)()
+
+        stages = [
+            ("content_html.render_cold", render_cold),
+            ("content_html.render_warm", render_warm),
+            ("content_html.stored", content_html_stored),
+            ("process_asin_thumbnails", legacy_thumbnails),
+            ("compile_asin_markup", single_pass_markup),
+            ("views.home", view(views.home)),
+            ("views.all", view(views.all)),
+            ("views.article", article_views),
+        ]
+        results = {}
+        for name, stage in stages:
+            results[name] = self.measure(stage, options["iterations"])
+            self.stdout.write("  {:<28} {:>9.2f} ms".format(name, results[name]["ms"]))
+        return results
+
+    def measure(self, stage, iterations):
+        """Median wall time over iterations, then one traced run for allocations and queries"""
+        stage()  # warm up imports, templates and connection
+        timings = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            stage()
+            timings.append((time.perf_counter() - started) * 1000)
+
+        tracemalloc.start()
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                stage()
+            allocated, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return {
+            "ms": round(statistics.median(timings), 3),
+            "min_ms": round(min(timings), 3),
+            "peak_kb": round(peak / 1024, 1),
+            "queries": len(queries.captured_queries),
+        }
+
+    def report(self, results, options):
+        baseline = None
+        path = options["baseline"]
+        if os.path.exists(path):
+            with open(path) as f:
+                baseline = json.load(f).get("stages")
+
+        self.stdout.write("")
+        self.stdout.write(
+            "{:<28} {:>10} {:>10} {:>10} {:>8}   {}".format(
+                "stage", "median ms", "min ms", "peak KB", "queries", "vs baseline"
+            )
+        )
+        regressions = []
+        for name, result in results.items():
+            compared = ""
+            previous = (baseline or {}).get(name)
+            if previous:
+                ratio = result["ms"] / previous["ms"] if previous["ms"] else 1.0
+                memory = result["peak_kb"] / previous["peak_kb"] if previous["peak_kb"] else 1.0
+                compared = "{:.2f}x time, {:.2f}x memory, {:+d} queries".format(
+                    ratio, memory, result["queries"] - previous["queries"]
+                )
+                if (
+                    ratio > options["threshold"]
+                    or memory > options["threshold"]
+                    or result["queries"] > previous["queries"]
+                ):
+                    regressions.append(name)
+                    compared = self.style.ERROR(compared + "  REGRESSED")
+            self.stdout.write(
+                "{:<28} {:>10.2f} {:>10.2f} {:>10.1f} {:>8}   {}".format(
+                    name, result["ms"], result["min_ms"], result["peak_kb"], result["queries"], compared
+                )
+            )
+
+        if options.get("save_baseline"):
+            with open(path, "w") as f:
+                json.dump(
+                    {
+                        "options": {
+                            key: options[key] for key in ("articles", "asins", "asinps", "links", "iterations")
+                        },
+                        "stages": results,
+                    },
+                    f,
+                    indent=2,
+                    sort_keys=True,
+                )
+            self.stdout.write(self.style.SUCCESS("Wrote baseline to {}.".format(path)))
+
+        if regressions and options.get("check"):
+            raise CommandError("Regressed against {}: {}".format(path, ", ".join(regressions)))
+        if baseline is None and not options.get("save_baseline"):
+            self.stdout.write("No baseline at {}; run with --save-baseline to create one.".format(path))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from blog.models import Article, ArticleAsin
+
+
+class Command(BaseCommand):
+    help = "Rebuild the ArticleAsin index from every article's content"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clear", action="store_true", help="Delete the whole index before rebuilding")
+
+    def handle(self, *args, **options):
+        if options.get("clear"):
+            ArticleAsin.objects.all().delete()
+
+        articles = 0
+        for article in Article.objects.only("id", "content").iterator():
+            article.sync_asins()
+            articles += 1
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Done. Indexed {ArticleAsin.objects.count()} ASIN references across {articles} articles.")
+        )
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from blog.models import RelatedArticle, rebuild_related
+
+
+class Command(BaseCommand):
+    help = "Rebuild the related-article candidates for every article"
+
+    def handle(self, *args, **options):
+        articles = rebuild_related()
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Done. Stored {RelatedArticle.objects.count()} related candidates across {articles} articles.")
+        )
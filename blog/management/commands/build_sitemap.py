@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from blog.models import rebuild_sitemap
+
+
+class Command(BaseCommand):
+    help = "Regenerate every stored sitemap entry"
+
+    def handle(self, *args, **options):
+        entries = rebuild_sitemap()
+
+        self.stdout.write(self.style.SUCCESS(f"Done. Stored {entries} sitemap entries."))
@@ -0,0 +1,43 @@
+import difflib
+
+from django.core.management.base import BaseCommand, CommandError
+
+from blog.models import Article, render_content_html_legacy
+
+
+class Command(BaseCommand):
+    help = "Check that the single-pass markup compiler matches the legacy pipeline for every article"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--slug", action="append", help="Only compare these articles (repeatable)")
+        parser.add_argument("--diff", action="store_true", help="Print a unified diff for mismatches")
+
+    def handle(self, *args, **options):
+        qs = Article.objects.all()
+        if options.get("slug"):
+            qs = qs.filter(slug__in=options["slug"])
+
+        checked = 0
+        mismatched = []
+        for article in qs.iterator():
+            expected = render_content_html_legacy(article.content, article.markup)
+            actual = article.render_content_html()
+            checked += 1
+            if actual == expected:
+                continue
+
+            mismatched.append(article.slug)
+            self.stdout.write(self.style.ERROR(f"Mismatch for {article.slug}"))
+            if options.get("diff"):
+                for line in difflib.unified_diff(
+                    expected.split("\n"),
+                    actual.split("\n"),
+                    fromfile="legacy",
+                    tofile="compiled",
+                    lineterm="",
+                ):
+                    self.stdout.write(line)
+
+        if mismatched:
+            raise CommandError(f"{len(mismatched)} of {checked} articles differ: {', '.join(mismatched)}")
+        self.stdout.write(self.style.SUCCESS(f"Done. {checked} articles identical."))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from blog.models import Article
+
+
+class Command(BaseCommand):
+    help = "Rebuild the stored compiled HTML for articles that are missing or stale"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--force", action="store_true", help="Recompile every article, even if fresh")
+
+    def handle(self, *args, **options):
+        compiled = 0
+        for article in Article.objects.all().iterator():
+            if article.content_html_fresh and not options.get("force"):
+                continue
+            article.refresh_content_html()
+            compiled += 1
+            self.stdout.write(f"Compiled {article.slug}")
+
+        self.stdout.write(self.style.SUCCESS(f"Done. Compiled {compiled} articles."))
@@ -0,0 +1,157 @@
+import gzip
+import hashlib
+import json
+import os
+
+import brotli
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+from django.urls import resolve, reverse
+
+from blog.models import Article
+from blog.sitemaps import shard_paths
+
+
+def manifest_path_for(root):
+    """
+    The manifest sits next to the export directory rather than in it, since
+    everything in the directory is served publicly
+    """
+    return os.path.normpath(os.path.abspath(root)) + ".manifest.json"
+
+
+def export_file_path(path):
+    """URL path -> file path under the export root, with index.html for directories"""
+    relative = path.lstrip("/")
+    if not relative or relative.endswith("/"):
+        relative += "index.html"
+    return relative
+
+
+class Command(BaseCommand):
+    help = "Render the public site to static files, with .gz and .br variants, re-exporting only what changed"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--output", default=None, help="Export directory (defaults to settings.STATIC_EXPORT_ROOT)"
+        )
+        parser.add_argument(
+            "--host", default="wheretostartreading.com", help="Host the pages and sitemap are rendered for"
+        )
+        parser.add_argument(
+            "--manifest", default=None, help="Manifest file (defaults to <output>.manifest.json beside the export)"
+        )
+        parser.add_argument("--force", action="store_true", help="Re-export every page, even if unchanged")
+
+    def handle(self, *args, **options):
+        root = options.get("output") or settings.STATIC_EXPORT_ROOT
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.factory = RequestFactory(HTTP_HOST=options["host"])
+
+        manifest_path = options.get("manifest") or manifest_path_for(root)
+        manifest = {}
+        if os.path.exists(manifest_path) and not options.get("force"):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+
+        articles = list(Article.objects.published())
+        navigation = self.navigation_signature(articles)
+
+        exported = {}
+        written = 0
+        for article in articles:
+            # Article pages are only re-rendered when something they show changed;
+            # rendering them again would only reshuffle the related picks
+            path = article.get_absolute_url()
+            source = hashlib.sha1(
+                "{}:{}:{}".format(article.modified_at.isoformat(), navigation, article.content_html).encode("utf-8")
+            ).hexdigest()
+            previous = manifest.get(path)
+            if previous and previous["source"] == source and os.path.exists(self.file_path(path)):
+                exported[path] = previous
+                continue
+            exported[path], changed = self.export(path, source, previous)
+            written += changed
+
+        # The listings, sitemap and robots.txt are cheap to render; they are
+        # rewritten only when their bytes changed
+        for path in [
+            reverse("home"),
+            reverse("all"),
+            reverse("django.contrib.sitemaps.views.sitemap"),
+            *shard_paths(),
+            "/robots.txt",
+        ]:
+            exported[path], changed = self.export(path, None, manifest.get(path))
+            written += changed
+
+        removed = 0
+        for path in set(manifest) - set(exported):
+            for name in self.variants(self.file_path(path)):
+                if os.path.exists(name):
+                    os.remove(name)
+            removed += 1
+            self.stdout.write(f"Removed {path}")
+
+        with open(manifest_path, "w") as f:
+            json.dump(exported, f, indent=2, sort_keys=True)
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Done. Wrote {written} of {len(exported)} pages, removed {removed}, into {root}.")
+        )
+
+    def navigation_signature(self, articles):
+        # Every article page shows the "All Articles" navigation
+        return hashlib.sha1(
+            repr(
+                sorted(
+                    (a.slug, a.title_short or "", a.modified_at.year, a.modified_at.month) for a in articles
+                )
+            ).encode("utf-8")
+        ).hexdigest()
+
+    def file_path(self, path):
+        return os.path.join(self.root, export_file_path(path))
+
+    def variants(self, name):
+        return [name, name + ".gz", name + ".br"]
+
+    def render(self, path):
+        request = self.factory.get(path, secure=True)
+        match = resolve(path)
+        response = match.func(request, *match.args, **match.kwargs)
+        if hasattr(response, "render") and callable(response.render):
+            response.render()
+        if response.status_code != 200:
+            raise CommandError(f"{path} returned {response.status_code}")
+        if response.streaming:
+            return b"".join(response.streaming_content)
+        return response.content
+
+    def export(self, path, source, previous):
+        """
+        Render path and write it with its compressed variants unless the bytes
+        are unchanged; returns its manifest entry and whether it was written.
+        """
+        content = self.render(path)
+        entry = {"source": source, "sha1": hashlib.sha1(content).hexdigest()}
+        name = self.file_path(path)
+        if previous and previous.get("sha1") == entry["sha1"] and os.path.exists(name):
+            return entry, False
+
+        os.makedirs(os.path.dirname(name), exist_ok=True)
+        self.write(name, content)
+        # mtime=0 so unchanged content always compresses to identical bytes
+        self.write(name + ".gz", gzip.compress(content, compresslevel=9, mtime=0))
+        self.write(name + ".br", brotli.compress(content))
+        self.stdout.write(f"Exported {path}")
+        return entry, True
+
+    def write(self, name, data):
+        # Write then rename, so a static host never serves a half-written file
+        tmp = name + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, name)
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from blog.caching import evict_site
+
+
+class Command(BaseCommand):
+    help = "Invalidate every cached page and ASIN image lookup by bumping the site generation"
+
+    def handle(self, *args, **options):
+        evict_site()
+        self.stdout.write(self.style.SUCCESS("Done. Site cache generation bumped."))
@@ -0,0 +1,316 @@
+import hashlib
+import hmac
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand, CommandError
+
+from blog import amazon_api
+
+AUTHORIZATION_RE = re.compile(
+    r"^AWS4-HMAC-SHA256 "
+    r"Credential=(?P<access_key>[^/\s]+)/(?P<date>\d{8})/(?P<region>[a-z0-9-]+)/(?P<service>[A-Za-z]+)/aws4_request, "
+    r"SignedHeaders=(?P<signed_headers>[a-z0-9;-]+), "
+    r"Signature=(?P<signature>[0-9a-f]{64})$"
+)
+
+# Headers PA-API refuses to accept unsigned
+REQUIRED_SIGNED_HEADERS = {"content-encoding", "host", "x-amz-date", "x-amz-target"}
+
+ERROR_TYPE = "com.amazon.paapi5#{}"
+
+
+def error_body(exception, code, message):
+    return {"__type": ERROR_TYPE.format(exception), "Errors": [{"Code": code, "Message": message}]}
+
+
+def not_accessible(asin):
+    return {
+        "Code": "ItemNotAccessible",
+        "Message": f"The ItemId {asin} is not accessible through the Product Advertising API.",
+    }
+
+
+def synthetic_item(asin):
+    return {
+        "ASIN": asin,
+        "DetailPageURL": f"https://www.amazon.com/dp/{asin}",
+        "ItemInfo": {"Title": {"DisplayValue": f"Stub item {asin}"}},
+        "Images": {
+            "Primary": {
+                "Medium": {"URL": f"https://m.media-amazon.com/images/I/{asin}._SL160_.jpg"},
+                "Large": {"URL": f"https://m.media-amazon.com/images/I/{asin}._SL500_.jpg"},
+            }
+        },
+    }
+
+
+def load_fixtures(paths):
+    """
+    Items and ItemNotAccessible errors by ASIN from recorded GetItems
+    response bodies; each file holds one response or a list of them.
+    """
+    items = {}
+    errors = {}
+    for path in paths:
+        try:
+            with open(path) as f:
+                recorded = json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Cannot read fixture {path}: {e}")
+        for response in recorded if isinstance(recorded, list) else [recorded]:
+            for item in response.get("ItemsResult", {}).get("Items", []):
+                items[item["ASIN"]] = item
+            for error in response.get("Errors", []):
+                match = re.search(r"ItemId (\S+)", error.get("Message") or "")
+                if match:
+                    errors[match.group(1)] = error
+    return items, errors
+
+
+def verify_signature(handler, body, match, secret_key):
+    """Recompute the SigV4 signature the way PaapiClient.signed_headers builds it"""
+    signed_headers = match.group("signed_headers")
+    canonical_headers = "".join(
+        f"{name}:{(handler.headers.get(name) or '').strip()}\n" for name in signed_headers.split(";")
+    )
+    payload_hash = hashlib.sha256(body).hexdigest()
+    canonical_request = f"POST\n{handler.path}\n\n{canonical_headers}\n{signed_headers}\n{payload_hash}"
+    credential_scope = "{}/{}/{}/aws4_request".format(
+        match.group("date"), match.group("region"), match.group("service")
+    )
+    string_to_sign = "AWS4-HMAC-SHA256\n{}\n{}\n{}".format(
+        handler.headers.get("x-amz-date"),
+        credential_scope,
+        hashlib.sha256(canonical_request.encode("utf-8")).hexdigest(),
+    )
+    key = amazon_api._get_signature_key(
+        secret_key, match.group("date"), match.group("region"), match.group("service")
+    )
+    expected = hmac.new(key, string_to_sign.encode("utf-8"), hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, match.group("signature"))
+
+
+class RateLimit:
+    """Non-blocking token bucket: PA-API answers 429 rather than queueing."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    server_version = "paapi-stub/1.0"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.options["verbosity"] > 1:
+            super().log_message(format, *args)
+
+    def respond(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        self.server.count(status)
+
+    def do_POST(self):
+        options = self.server.options
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+        if self.path != amazon_api.PAAPI_PATH:
+            return self.respond(404, error_body("UnrecognizedClientException", "NotFound", f"No route {self.path}"))
+        problem = self.check_request(body)
+        if problem:
+            return self.respond(401, error_body("InvalidSignatureException", "InvalidSignature", problem))
+        try:
+            payload = json.loads(body)
+            asins = list(payload["ItemIds"])
+        except (ValueError, KeyError, TypeError):
+            return self.respond(
+                400, error_body("ValidationException", "InvalidParameterValue", "Body is not a GetItems request.")
+            )
+        if not 1 <= len(asins) <= amazon_api.PAAPI_MAX_ITEM_IDS:
+            return self.respond(
+                400,
+                error_body(
+                    "ValidationException",
+                    "InvalidParameterValue",
+                    f"ItemIds must hold 1 to {amazon_api.PAAPI_MAX_ITEM_IDS} values.",
+                ),
+            )
+
+        latency = options["latency"] + options["latency_per_item"] * len(asins)
+        latency += random.uniform(-options["jitter"], options["jitter"])
+        if latency > 0:
+            time.sleep(latency / 1000)
+
+        if (self.server.limit and not self.server.limit.allow()) or random.random() < options["throttle_rate"]:
+            return self.respond(
+                429,
+                error_body(
+                    "TooManyRequestsException",
+                    "TooManyRequests",
+                    "The request was denied due to request throttling. Please verify the number of requests "
+                    "made per second to the Amazon Product Advertising API.",
+                ),
+            )
+        if random.random() < options["error_rate"]:
+            status = random.choice(options["error_statuses"])
+            return self.respond(
+                status, error_body("InternalFailureException", "InternalFailure", "The request processing has failed.")
+            )
+
+        items = []
+        errors = []
+        for asin in asins:
+            item = self.server.items.get(asin)
+            if item is None and asin not in self.server.errors and options["unknown"] == "synthesize":
+                item = synthetic_item(asin)
+            if item is None or random.random() < options["partial_rate"]:
+                errors.append(self.server.errors.get(asin) or not_accessible(asin))
+            else:
+                items.append(item)
+
+        response = {}
+        if items:
+            response["ItemsResult"] = {"Items": items}
+        if errors:
+            response["Errors"] = errors
+        self.respond(200, response)
+
+    def check_request(self, body):
+        """Why the request would fail Amazon's authentication, or None"""
+        headers = self.headers
+        match = AUTHORIZATION_RE.match(headers.get("Authorization") or "")
+        if match is None:
+            return "Authorization is not an AWS4-HMAC-SHA256 Credential/SignedHeaders/Signature header."
+        if match.group("service") != amazon_api.PAAPI_SERVICE:
+            return f"Credential scope names service {match.group('service')}, not {amazon_api.PAAPI_SERVICE}."
+        missing = REQUIRED_SIGNED_HEADERS - set(match.group("signed_headers").split(";"))
+        if missing:
+            return f"SignedHeaders is missing {', '.join(sorted(missing))}."
+        if not (headers.get("x-amz-date") or "").startswith(match.group("date")):
+            return "X-Amz-Date does not match the credential scope date."
+        if headers.get("x-amz-target") != amazon_api.PAAPI_TARGET:
+            return f"X-Amz-Target must be {amazon_api.PAAPI_TARGET}."
+        content_hash = headers.get("x-amz-content-sha256")
+        if content_hash and content_hash != hashlib.sha256(body).hexdigest():
+            return "X-Amz-Content-Sha256 does not match the body."
+        secret_key = self.server.options["secret_key"]
+        if secret_key and not verify_signature(self, body, match, secret_key):
+            return "The request signature does not match the one computed with --secret-key."
+        return None
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, options, items, errors):
+        super().__init__(address, StubHandler)
+        self.options = options
+        self.items = items
+        self.errors = errors
+        self.limit = RateLimit(options["tps"], options["burst"]) if options["tps"] else None
+        self.statuses = {}
+        self.lock = threading.Lock()
+
+    def count(self, status):
+        with self.lock:
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+
+
+class Command(BaseCommand):
+    help = (
+        "Serve a local stand-in for the PA-API GetItems endpoint from recorded fixtures, "
+        "with injected latency, throttling and errors. Point the site at it with "
+        "AMAZON_PAAPI_SCHEME=http AMAZON_PAAPI_HOST=<bind>:<port>."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--bind", default="127.0.0.1", help="Address to listen on")
+        parser.add_argument("--port", type=int, default=8765, help="Port to listen on")
+        parser.add_argument(
+            "--fixtures",
+            action="append",
+            default=[],
+            help="Recorded GetItems response JSON (one response or a list); may be repeated",
+        )
+        parser.add_argument(
+            "--unknown",
+            choices=("synthesize", "error"),
+            default="synthesize",
+            help="Answer ASINs missing from the fixtures with a generated item or an ItemNotAccessible error",
+        )
+        parser.add_argument("--latency", type=float, default=0.0, help="Milliseconds added to every response")
+        parser.add_argument("--latency-per-item", type=float, default=0.0, help="Milliseconds added per ItemId")
+        parser.add_argument("--jitter", type=float, default=0.0, help="Random +/- milliseconds on the latency")
+        parser.add_argument(
+            "--tps", type=float, default=None, help="Requests per second allowed before answering 429 (PA-API: 1)"
+        )
+        parser.add_argument("--burst", type=int, default=1, help="Requests the --tps bucket may bank")
+        parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of requests answered 429")
+        parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered 5xx")
+        parser.add_argument(
+            "--error-statuses",
+            default="500,503",
+            help="Comma-separated statuses --error-rate picks from",
+        )
+        parser.add_argument(
+            "--partial-rate",
+            type=float,
+            default=0.0,
+            help="Fraction of ItemIds moved from Items to Errors as ItemNotAccessible",
+        )
+        parser.add_argument(
+            "--secret-key",
+            default=None,
+            help="Also check each signature against this secret key, not just the Authorization header shape",
+        )
+        parser.add_argument("--seed", type=int, default=None, help="Seed the injected failures for repeatable runs")
+
+    def handle(self, *args, **options):
+        try:
+            options["error_statuses"] = [int(s) for s in options["error_statuses"].split(",") if s.strip()]
+        except ValueError:
+            raise CommandError("--error-statuses takes comma-separated HTTP status codes")
+        if options["error_rate"] and not options["error_statuses"]:
+            raise CommandError("--error-rate needs at least one --error-statuses code")
+        if options["seed"] is not None:
+            random.seed(options["seed"])
+
+        items, errors = load_fixtures(options["fixtures"])
+        server = StubServer((options["bind"], options["port"]), options, items, errors)
+        host = "{}:{}".format(*server.server_address[:2])
+        self.stdout.write(
+            f"PA-API stub on http://{host}{amazon_api.PAAPI_PATH} with {len(items)} fixture items "
+            f"and {len(errors)} fixture errors; unknown ASINs: {options['unknown']}."
+        )
+        self.stdout.write(f"Use AMAZON_PAAPI_SCHEME=http AMAZON_PAAPI_HOST={host} and any PA-API credentials.")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            summary = ", ".join(f"{status}: {n}" for status, n in sorted(server.statuses.items()))
+            self.stdout.write(self.style.SUCCESS(f"Stopped. Responses by status: {summary or 'none'}."))
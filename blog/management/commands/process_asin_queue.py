@@ -0,0 +1,76 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from blog.models import AmazonProduct, _fetch_asin_images_many
+from blog import amazon_api, metrics
+
+
+class Command(BaseCommand):
+    help = "Fetch images from PA-API for ASINs queued by page renders"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=50, help="Maximum ASINs to fetch per drain")
+        parser.add_argument("--loop", action="store_true", help="Keep draining the queue until interrupted")
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=30.0,
+            help="Seconds to wait between drains when the queue is empty (with --loop)",
+        )
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=1.0,
+            help="Sleep in seconds between API calls to respect rate limits",
+        )
+        parser.add_argument(
+            "--verbose", action="store_true", help="Print detailed PA-API responses and decisions"
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            processed = self.drain(options)
+            metrics.flush()
+            if not options.get("loop"):
+                break
+            if not processed:
+                time.sleep(options["interval"])
+
+    def drain(self, options):
+        verbose = options.get("verbose", False)
+        asins = list(
+            AmazonProduct.objects.filter(queued_at__isnull=False)
+            .order_by("queued_at")
+            .values_list("asin", flat=True)[: options["limit"]]
+        )
+
+        count = 0
+        for i in range(0, len(asins), amazon_api.PAAPI_MAX_ITEM_IDS):
+            batch = asins[i:i + amazon_api.PAAPI_MAX_ITEM_IDS]
+            try:
+                fetched = _fetch_asin_images_many(batch, verbose=verbose)
+            except amazon_api.PaapiThrottled:
+                # Leave the rest queued; --loop waits an --interval before retrying
+                self.stdout.write(self.style.WARNING("Throttled by PA-API; pausing this drain."))
+                return 0
+            unanswered = [asin for asin in batch if asin not in fetched]
+            if unanswered:
+                # The call failed; move these to the back of the queue, images untouched
+                AmazonProduct.objects.filter(asin__in=unanswered).update(queued_at=timezone.now())
+            if not fetched:
+                self.stdout.write(self.style.WARNING("PA-API did not answer; pausing this drain."))
+                return 0
+            for asin, res in fetched.items():
+                if res:
+                    count += 1
+                    self.stdout.write(self.style.SUCCESS(f"Cached images for {asin}"))
+                else:
+                    self.stdout.write(self.style.WARNING(f"No images for {asin}"))
+            if options.get("sleep", 0):
+                time.sleep(options["sleep"])
+
+        if asins:
+            self.stdout.write(self.style.SUCCESS(f"Done. Updated {count} ASINs. Processed {len(asins)}."))
+        return len(asins)
@@ -0,0 +1,223 @@
+"""
+Fleet-wide counters and histograms.
+
+Each process adds to a local buffer, and a background thread folds it into
+the shared cache with cache.incr every FLUSH_INTERVAL seconds and once more
+at exit, so every gunicorn worker (and the management commands) adds to the
+same totals whether or not more traffic arrives, and no request waits on
+those writes. export() renders the totals in the Prometheus text format for
+the metrics endpoint.
+
+Labels take a fixed set of values, anything else is counted as "other", so
+the endpoint can read every key back without keeping an index of them.
+Counts live in the cache and can be lost when it is flushed or evicted;
+Prometheus treats that as a counter reset.
+"""
+import atexit
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.core.cache import cache
+
+# Seconds a process buffers increments before writing them to the cache
+FLUSH_INTERVAL = 10.0
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+REGISTRY = []
+
+_lock = threading.Lock()
+_pending = defaultdict(int)
+# Process the flush thread was started in; a forked worker starts its own
+_flusher_pid = None
+
+
+def _add(key, amount):
+    with _lock:
+        _pending[key] += amount
+    if _flusher_pid != os.getpid():
+        _start_flusher()
+
+
+def _start_flusher():
+    global _flusher_pid
+    with _lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+    threading.Thread(target=_flush_forever, name="metrics-flush", daemon=True).start()
+
+
+def _flush_forever():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        flush()
+
+
+def flush():
+    """Write this process's buffered increments to the shared cache."""
+    global _pending
+    with _lock:
+        pending, _pending = _pending, defaultdict(int)
+    for key, amount in pending.items():
+        try:
+            try:
+                cache.incr(key, amount)
+            except ValueError:
+                # First increment since the cache was emptied; add() loses a race to another worker
+                if not cache.add(key, amount, None):
+                    cache.incr(key, amount)
+        except Exception:
+            # Metrics never break the caller
+            pass
+
+
+def _forked():
+    # The parent flushes what it buffered before the fork; the child has no flush thread yet
+    global _lock, _pending
+    _lock = threading.Lock()
+    _pending = defaultdict(int)
+
+
+os.register_at_fork(after_in_child=_forked)
+# The flush thread is a daemon, so whatever it has not written yet goes now
+atexit.register(flush)
+
+
+class Counter:
+    def __init__(self, name, help, label=None, values=()):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.values = tuple(values) + ("other",) if label else ("",)
+        REGISTRY.append(self)
+
+    def _label_value(self, value):
+        if self.label is None:
+            return ""
+        value = str(value)
+        return value if value in self.values else "other"
+
+    def _key(self, value, suffix="count"):
+        return f"metrics:{self.name}:{value}:{suffix}"
+
+    def _labels(self, value, **extra):
+        labels = dict({self.label: value} if self.label else {}, **extra)
+        if not labels:
+            return ""
+        return "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}"
+
+    def inc(self, value=None, amount=1):
+        if amount:
+            _add(self._key(self._label_value(value)), amount)
+
+    def keys(self):
+        return [self._key(value) for value in self.values]
+
+    def samples(self, totals):
+        for value in self.values:
+            yield f"{self.name}{self._labels(value)} {totals.get(self._key(value), 0)}"
+
+    def render(self, totals):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {type(self).__name__.lower()}"
+        yield from self.samples(totals)
+
+
+class Histogram(Counter):
+    """
+    A counter per bucket plus the sum, stored in microseconds since the cache
+    only increments integers.
+    """
+
+    def __init__(self, name, help, buckets, label=None, values=()):
+        super().__init__(name, help, label, values)
+        self.buckets = tuple(buckets)
+
+    def observe(self, seconds, value=None):
+        value = self._label_value(value)
+        for le in self.buckets:
+            if seconds <= le:
+                _add(self._key(value, le), 1)
+                break
+        else:
+            _add(self._key(value, "inf"), 1)
+        _add(self._key(value, "sum"), round(seconds * 1000000))
+
+    @contextmanager
+    def time(self, value=None):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, value)
+
+    def keys(self):
+        return [
+            self._key(value, suffix) for value in self.values for suffix in self.buckets + ("inf", "sum")
+        ]
+
+    def samples(self, totals):
+        for value in self.values:
+            cumulative = 0
+            for le in self.buckets + ("inf",):
+                cumulative += totals.get(self._key(value, le), 0)
+                bound = "+Inf" if le == "inf" else le
+                yield f"{self.name}_bucket{self._labels(value, le=bound)} {cumulative}"
+            total = totals.get(self._key(value, "sum"), 0) / 1000000
+            yield f"{self.name}_sum{self._labels(value)} {total}"
+            yield f"{self.name}_count{self._labels(value)} {cumulative}"
+
+
+def export():
+    """Every registered metric, totalled across processes, as Prometheus text"""
+    flush()
+    keys = [key for metric in REGISTRY for key in metric.keys()]
+    totals = cache.get_many(keys)
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render(totals))
+    return "\n".join(lines) + "\n"
+
+
+PAAPI_STATUSES = ("200", "400", "401", "403", "404", "429", "500", "502", "503", "504", "none")
+
+page_cache_requests = Counter(
+    "blog_page_cache_requests_total",
+    "GET/HEAD requests answered from the page cache (hit) or passed to the view (miss).",
+    "result",
+    ("hit", "miss"),
+)
+asin_images_lookups = Counter(
+    "blog_asin_images_lookups_total",
+    "ASIN image lookups by where they were answered; negative_hit is a cached known miss, "
+    "miss went to the database.",
+    "result",
+    ("local_hit", "hit", "negative_hit", "miss"),
+)
+paapi_requests = Counter(
+    "blog_paapi_requests_total",
+    "PA-API GetItems calls by HTTP status; none means no response came back.",
+    "status",
+    PAAPI_STATUSES,
+)
+paapi_request_seconds = Histogram(
+    "blog_paapi_request_seconds",
+    "PA-API GetItems call latency.",
+    (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+content_html_render_seconds = Histogram(
+    "blog_content_html_render_seconds",
+    "Time to render an article body to HTML.",
+    (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+backfill_asins = Counter(
+    "blog_backfill_asins_total",
+    "ASINs handled by backfill_amazon_images: stored with images, stored without, or given up after "
+    "repeated throttling or errors.",
+    "result",
+    ("updated", "no_images", "gave_up"),
+)
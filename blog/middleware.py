@@ -0,0 +1,152 @@
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.middleware import cache as cache_middleware
+from django.utils.cache import (
+    get_cache_key,
+    get_max_age,
+    has_vary_header,
+    learn_cache_key,
+    patch_response_headers,
+)
+
+from . import metrics, timing
+from .caching import page_key_prefix
+
+logger = logging.getLogger("blog.timing")
+
+
+class ServerTimingMiddleware:
+    """
+    Adds a Server-Timing header splitting each response's time between the
+    database, cache, PA-API and markup, and with SERVER_TIMING_LOG logs the
+    same numbers as one JSON line to the "blog.timing" logger.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.SERVER_TIMING:
+            return self.get_response(request)
+
+        token = timing.start()
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(self.time_query):
+                response = self.get_response(request)
+        finally:
+            total = time.perf_counter() - started
+            timings = timing.stop(token)
+
+        response["Server-Timing"] = timing.server_timing_header(timings, total)
+        if settings.SERVER_TIMING_LOG:
+            logger.info(
+                json.dumps(
+                    {
+                        "method": request.method,
+                        "path": request.path,
+                        "status": response.status_code,
+                        "total_ms": round(total * 1000, 1),
+                        **{
+                            name: {"ms": round(seconds * 1000, 1), "count": count}
+                            for name, (seconds, count) in timings.items()
+                        },
+                    }
+                )
+            )
+        return response
+
+    def time_query(self, execute, sql, params, many, context):
+        with timing.timed("db"):
+            return execute(sql, params, many, context)
+
+
+def _request_key_prefix(middleware, request):
+    # Worked out once per request by the fetch half and reused by the update half
+    if not hasattr(request, "_page_cache_key_prefix"):
+        request._page_cache_key_prefix = page_key_prefix(middleware.key_prefix, request.path)
+    return request._page_cache_key_prefix
+
+
+class FetchFromCacheMiddleware(cache_middleware.FetchFromCacheMiddleware):
+    """
+    FetchFromCacheMiddleware keyed under the site and page generations, so
+    bumping either one invalidates the page without deleting anything.
+    """
+
+    def process_request(self, request):
+        if request.method not in ("GET", "HEAD"):
+            request._cache_update_cache = False
+            return None  # Don't bother checking the cache.
+
+        key_prefix = _request_key_prefix(self, request)
+        with timing.timed("cache"):
+            cache_key = get_cache_key(request, key_prefix, "GET", cache=self.cache)
+            if cache_key is None:
+                response = None
+            else:
+                response = self.cache.get(cache_key)
+                if response is None and request.method == "HEAD":
+                    cache_key = get_cache_key(request, key_prefix, "HEAD", cache=self.cache)
+                    response = self.cache.get(cache_key)
+
+        if response is None:
+            metrics.page_cache_requests.inc("miss")
+            request._cache_update_cache = True
+            return None  # No cache information available, need to rebuild.
+
+        metrics.page_cache_requests.inc("hit")
+        request._cache_update_cache = False
+        return response
+
+
+class UpdateCacheMiddleware(cache_middleware.UpdateCacheMiddleware):
+    """
+    UpdateCacheMiddleware storing pages under the same generational prefix
+    as FetchFromCacheMiddleware above.
+    """
+
+    def process_response(self, request, response):
+        if not self._should_update_cache(request, response):
+            return response
+
+        if response.streaming or response.status_code not in (200, 304):
+            return response
+
+        if (
+            not request.COOKIES
+            and response.cookies
+            and has_vary_header(response, "Cookie")
+        ):
+            return response
+
+        if "private" in response.get("Cache-Control", ()):
+            return response
+
+        timeout = self.page_timeout
+        if timeout is None:
+            timeout = get_max_age(response)
+            if timeout is None:
+                timeout = self.cache_timeout
+            elif timeout == 0:
+                return response
+        patch_response_headers(response, timeout)
+        if timeout and response.status_code == 200:
+            cache_key = learn_cache_key(
+                request,
+                response,
+                timeout,
+                _request_key_prefix(self, request),
+                cache=self.cache,
+            )
+            if hasattr(response, "render") and callable(response.render):
+                response.add_post_render_callback(
+                    lambda r: self.cache.set(cache_key, r, timeout)
+                )
+            else:
+                self.cache.set(cache_key, response, timeout)
+        return response
@@ -0,0 +1,25 @@
+# Generated by Django 4.2 on 2026-10-17 22:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blog", "0009_amazonproduct_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="article",
+            name="content_html_compiled",
+            field=models.TextField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="article",
+            name="content_html_digest",
+            field=models.CharField(
+                blank=True, editable=False, max_length=40, null=True
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-17 22:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blog", "0010_article_content_html_compiled"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="amazonproduct",
+            name="queued_at",
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 4.2 on 2026-10-17 22:21
+
+import re
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Copied from blog.models as of this migration, so later changes there do not alter it
+RE_ASIN = re.compile(r"ASIN[ ]([0-9A-Z]{10})")
+RE_ASINP_ASIN = re.compile(r"<ASINP[ ]([0-9A-Z]{10})")
+
+
+def referenced_asins(content):
+    asins = [m.group(1) for m in RE_ASIN.finditer(content or "")]
+    asins.extend(m.group(1) for m in RE_ASINP_ASIN.finditer(content or ""))
+    return list(dict.fromkeys(asins))
+
+
+def build_article_asins(apps, schema_editor):
+    Article = apps.get_model("blog", "Article")
+    ArticleAsin = apps.get_model("blog", "ArticleAsin")
+    rows = []
+    for article_id, content in Article.objects.values_list("id", "content").iterator():
+        rows.extend(
+            ArticleAsin(article_id=article_id, asin=asin)
+            for asin in referenced_asins(content)
+        )
+    ArticleAsin.objects.bulk_create(rows, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blog", "0012_backfillcheckpoint"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ArticleAsin",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("asin", models.CharField(db_index=True, max_length=10)),
+                (
+                    "article",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="asins",
+                        to="blog.article",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("article", "asin")},
+            },
+        ),
+        migrations.RunPython(build_article_asins, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,124 @@
+# Generated by Django 4.2 on 2026-10-17 22:26
+
+import heapq
+import math
+import re
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Copied from blog.models as of this migration, so later changes there do not alter it
+RELATED_CANDIDATES = 12
+RELATED_ASIN_WEIGHT = 3.0
+RE_RELATED_TERM = re.compile(r"[a-z0-9]+")
+RELATED_STOPWORDS = frozenset(
+    "a an and are as at be by for from how in into is it of on or the to with".split()
+)
+
+
+def related_terms(*texts):
+    terms = set()
+    for text in texts:
+        for term in RE_RELATED_TERM.findall((text or "").lower()):
+            if len(term) > 2 and term not in RELATED_STOPWORDS:
+                terms.add(term)
+    return terms
+
+
+def related_features(articles, references):
+    features = {}
+    for pk, title, title_short, description in articles:
+        features[pk] = (set(), related_terms(title, title_short, description))
+    for article_id, asin in references:
+        if article_id in features:
+            features[article_id][0].add(asin)
+    return features
+
+
+def related_candidates(features, article_ids, limit=RELATED_CANDIDATES):
+    counts = {}
+    for _, terms in features.values():
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+    idf = {term: math.log(len(features) / count) for term, count in counts.items()}
+
+    candidates = {}
+    for pk in article_ids:
+        asins, terms = features[pk]
+        scores = []
+        for other, (other_asins, other_terms) in features.items():
+            if other == pk:
+                continue
+            score = RELATED_ASIN_WEIGHT * len(asins & other_asins)
+            score += sum(idf[term] for term in terms & other_terms)
+            if score > 0:
+                scores.append((score, other))
+        candidates[pk] = heapq.nlargest(limit, scores)
+    return candidates
+
+
+def build_related_articles(apps, schema_editor):
+    Article = apps.get_model("blog", "Article")
+    ArticleAsin = apps.get_model("blog", "ArticleAsin")
+    RelatedArticle = apps.get_model("blog", "RelatedArticle")
+    features = related_features(
+        Article.objects.exclude(published_at=None).values_list(
+            "id", "title", "title_short", "description"
+        ),
+        ArticleAsin.objects.exclude(article__published_at=None).values_list(
+            "article_id", "asin"
+        ),
+    )
+    RelatedArticle.objects.bulk_create(
+        [
+            RelatedArticle(article_id=pk, related_id=other, score=score)
+            for pk, scored in related_candidates(features, list(features)).items()
+            for score, other in scored
+        ]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blog", "0013_articleasin"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RelatedArticle",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("score", models.FloatField()),
+                (
+                    "article",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="related_candidates",
+                        to="blog.article",
+                    ),
+                ),
+                (
+                    "related",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="related_from",
+                        to="blog.article",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["article", "-score"],
+                "unique_together": {("article", "related")},
+            },
+        ),
+        migrations.RunPython(build_related_articles, migrations.RunPython.noop),
+    ]
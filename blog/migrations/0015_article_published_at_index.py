@@ -0,0 +1,23 @@
+# Generated by Django 4.2 on 2026-10-17 22:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blog", "0014_relatedarticle"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="article",
+            name="published_at",
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name="historicalarticle",
+            name="published_at",
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
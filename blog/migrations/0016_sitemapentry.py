@@ -0,0 +1,92 @@
+# Generated by Django 4.2 on 2026-10-17 22:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.utils import timezone
+
+
+# Copied from blog.models as of this migration, so later changes there do not alter it
+def sitemap_url_xml(lastmod=None, changefreq=None, priority=None):
+    xml = ""
+    if lastmod:
+        xml += "<lastmod>{}</lastmod>".format(
+            timezone.localtime(lastmod).strftime("%Y-%m-%d")
+        )
+    if changefreq:
+        xml += "<changefreq>{}</changefreq>".format(changefreq)
+    if priority:
+        xml += "<priority>{}</priority>".format(priority)
+    return xml + "</url>"
+
+
+def build_sitemap_entries(apps, schema_editor):
+    from django.urls import NoReverseMatch, reverse
+
+    Article = apps.get_model("blog", "Article")
+    SitemapEntry = apps.get_model("blog", "SitemapEntry")
+    entries = [
+        SitemapEntry(
+            location=reverse("home"),
+            xml=sitemap_url_xml(changefreq="daily", priority="0.5"),
+        )
+    ]
+    for article in Article.objects.exclude(published_at=None).iterator():
+        try:
+            location = reverse("article", args=[article.slug])
+        except NoReverseMatch:
+            continue
+        entries.append(
+            SitemapEntry(
+                location=location,
+                article_id=article.id,
+                published_at=article.published_at,
+                lastmod=article.modified_at,
+                xml=sitemap_url_xml(lastmod=article.modified_at, priority="0.6"),
+            )
+        )
+    SitemapEntry.objects.bulk_create(entries)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blog", "0015_article_published_at_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SitemapEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("location", models.CharField(max_length=255, unique=True)),
+                (
+                    "published_at",
+                    models.DateTimeField(blank=True, db_index=True, null=True),
+                ),
+                ("lastmod", models.DateTimeField(blank=True, null=True)),
+                ("xml", models.TextField()),
+                (
+                    "article",
+                    models.OneToOneField(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="sitemap_entry",
+                        to="blog.article",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name_plural": "sitemap entries",
+            },
+        ),
+        migrations.RunPython(build_sitemap_entries, migrations.RunPython.noop),
+    ]
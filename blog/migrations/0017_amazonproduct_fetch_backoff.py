@@ -0,0 +1,33 @@
+# Generated by Django 4.2 on 2026-10-17 22:33
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def schedule_known_misses(apps, schema_editor):
+    # Misses recorded before backoff existed get one retry, then back off
+    AmazonProduct = apps.get_model("blog", "AmazonProduct")
+    AmazonProduct.objects.filter(fetch_status="miss").update(
+        fetch_attempts=1, next_retry_at=timezone.now()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blog", "0016_sitemapentry"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="amazonproduct",
+            name="fetch_attempts",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="amazonproduct",
+            name="next_retry_at",
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(schedule_known_misses, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2 on 2026-10-17 22:53
+
+from django.db import migrations, models
+
+
+def recompile_on_next_view(apps, schema_editor):
+    # HTML compiled before this has no expiry; the next view recompiles it with one
+    Article = apps.get_model("blog", "Article")
+    Article.objects.update(content_html_digest=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blog", "0017_amazonproduct_fetch_backoff"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="article",
+            name="content_html_expires_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(recompile_on_next_view, migrations.RunPython.noop),
+    ]
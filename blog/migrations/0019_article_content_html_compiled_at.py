@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-17 23:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blog", "0018_article_content_html_expires_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="article",
+            name="content_html_compiled_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
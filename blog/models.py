@@ -1,16 +1,33 @@
+import hashlib
+import heapq
+import math
+import random
 import re
 import markdown
-from typing import Optional, Tuple
+from markdown.extensions import Extension
+from markdown.preprocessors import Preprocessor
+from typing import Dict, Optional, Tuple
 
+from django.conf import settings
 from django.core.cache import cache
-from django.urls import reverse
-from django.db import models
-from django.db.models.signals import post_save
+from django.urls import NoReverseMatch, reverse
+from django.db import models, transaction
+from django.db.models import DEFERRED, Q
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.utils import timezone
 
 from simple_history.models import HistoricalRecords
 
+from . import metrics, timing
+from .caching import (
+    asin_images_keys,
+    asin_images_local,
+    evict_asin_images,
+    evict_navigation,
+    evict_pages,
+)
+
 
 MARKUP_CHOICES = [
     ["markdown", "Markdown"],
@@ -20,9 +37,30 @@ MARKUP_CHOICES = [
 AFFILIATE_ID = "wtsr-20"
 RE_ASIN = re.compile(r"ASIN[ ]([0-9A-Z]{10})")
 RE_ASINP = re.compile(r"<ASINP[ ]([0-9A-Z]{10})[ ]?([^>]*)>[ ](.*)")
+RE_ASINP_ASIN = re.compile(r"<ASINP[ ]([0-9A-Z]{10})")
 TWITTER_AT = re.compile(r"@([A-Za-z0-9_]+)")
 OFFSITE_LINKS = re.compile(r'href=["\']http')
 ASIN_LINKS = re.compile(r'href="https://www.amazon.com/dp/([0-9A-Z]{10})')
+# RE_ASIN and TWITTER_AT in one scan. The first branch catches a handle ending
+# in "ASIN" right before an ASIN, which the old two-pass order turned into a
+# twitter link wrapped around the Amazon URL.
+INLINE_REFERENCES = re.compile(
+    r"@([A-Za-z0-9_]*)ASIN[ ]([0-9A-Z]{10})|ASIN[ ]([0-9A-Z]{10})|@([A-Za-z0-9_]+)"
+)
+# ASIN_LINKS and OFFSITE_LINKS in one scan (unescaped dots kept to match ASIN_LINKS)
+LINK_ATTRIBUTES = re.compile(
+    r'href="https://www.amazon.com/dp/([0-9A-Z]{10})|href=["\']http'
+)
+
+# Bump whenever the markup pipeline changes so stored article HTML is rebuilt.
+CONTENT_HTML_VERSION = 1
+
+# Cached in place of an image tuple for ASINs known to have no images, since
+# a cached None can't be told apart from a missing key
+ASIN_IMAGES_MISS = "miss"
+# Retries of ASINs without images back off from an hour, doubling up to 30 days
+ASIN_RETRY_BASE = timezone.timedelta(hours=1)
+ASIN_RETRY_MAX = timezone.timedelta(days=30)
 
 
 def asin_to_url(asin):
@@ -38,6 +76,11 @@ class AmazonProduct(models.Model):
     image_url_2x = models.URLField(max_length=500, null=True, blank=True)
     last_fetched_at = models.DateTimeField(null=True, blank=True)
     fetch_status = models.CharField(max_length=50, null=True, blank=True)
+    # Set while waiting for the process_asin_queue worker to fetch from PA-API
+    queued_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    # Fetches in a row that found no images, and when to try again
+    fetch_attempts = models.IntegerField(default=0)
+    next_retry_at = models.DateTimeField(null=True, blank=True, db_index=True)
 
     def __str__(self):
         return f"{self.asin}"
@@ -46,83 +89,300 @@ class AmazonProduct(models.Model):
         indexes = [models.Index(fields=["asin"])]
 
 
-def _get_cached_asin_images(asin: str) -> Optional[Tuple[str, str, Optional[str]]]:
-    """Return (image_url, image_url_2x, title) from DB/cache if fresh enough."""
-    cache_key = f"asin-images:{asin}"
-    cached = cache.get(cache_key)
-    if cached:
-        return cached
-    try:
-        ap = AmazonProduct.objects.filter(asin=asin).first()
-    except Exception:
-        ap = None
+class BackfillCheckpoint(models.Model):
+    """Last ASIN committed by a backfill_amazon_images run, for --resume."""
+
+    name = models.CharField(max_length=50, unique=True)
+    cursor = models.CharField(max_length=10, null=True, blank=True)
+    processed = models.IntegerField(default=0)
+    updated = models.IntegerField(default=0)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.cursor}"
+
+
+def _asin_images_from_product(ap) -> Optional[Tuple[str, str, Optional[str]]]:
     if ap and ap.image_url:
-        # consider fresh if fetched within 30 days
+        # Served until the hard TTL, stale or not
         if not ap.last_fetched_at or (
             timezone.now() - ap.last_fetched_at
-        ).days <= 30:
-            data = (ap.image_url, ap.image_url_2x or ap.image_url, ap.title)
-            cache.set(cache_key, data, 60 * 60)  # 1 hour
-            return data
+        ).total_seconds() <= settings.AMAZON_IMAGE_HARD_TTL:
+            return (ap.image_url, ap.image_url_2x or ap.image_url, ap.title)
     return None
 
 
-def _store_asin_images(
-    asin: str, image_url: Optional[str], image_url_2x: Optional[str], title: Optional[str], status: str
-) -> Optional[Tuple[str, str, Optional[str]]]:
-    try:
-        ap, _ = AmazonProduct.objects.get_or_create(asin=asin)
-        ap.image_url = image_url
-        ap.image_url_2x = image_url_2x
-        if title:
-            ap.title = title
-        ap.last_fetched_at = timezone.now()
-        ap.fetch_status = status
-        ap.save()
+def _asin_images_stale(ap, now) -> bool:
+    """
+    Whether a row's images are past the soft TTL and due a background
+    refresh, unless a refresh that found nothing set a retry not yet due.
+    """
+    return bool(
+        ap.image_url
+        and ap.last_fetched_at
+        and (now - ap.last_fetched_at).total_seconds() > settings.AMAZON_IMAGE_SOFT_TTL
+        and (ap.next_retry_at is None or ap.next_retry_at <= now)
+    )
+
+
+def _asin_retry_delay(attempts: int) -> timezone.timedelta:
+    return min(ASIN_RETRY_BASE * 2 ** max(attempts - 1, 0), ASIN_RETRY_MAX)
+
+
+def _asin_known_miss(ap, now) -> bool:
+    """Whether the last fetch found no images and the retry is not due yet."""
+    return bool(ap and not ap.image_url and ap.next_retry_at and ap.next_retry_at > now)
+
+
+def _cache_asin_misses(asins, retry_at) -> None:
+    """Cache the miss sentinel for these ASINs, at most an hour and not past retry_at."""
+    keys = asin_images_keys(asins)
+    if keys:
+        timeout = int(min(max((retry_at - timezone.now()).total_seconds(), 60), 60 * 60))
+        cache.set_many({key: ASIN_IMAGES_MISS for key in keys.values()}, timeout)
+
+
+def _get_cached_asin_images_many(asins, local=True) -> Dict[str, Optional[Tuple[str, str, Optional[str]]]]:
+    """
+    (image_url, image_url_2x, title) for each ASIN with usable stored images:
+    the in-process cache unless local is False, then one cache.get_many, one
+    query and one cache.set_many for what is left.
+    ASINs known to have no images until their retry map to None; ASINs
+    with nothing usable stored are left out.
+    """
+    asins = list(asins)
+    # The in-process cache can trail another process's eviction by up to a second
+    local = asin_images_local.get_many(asins) if local else {}
+    keys = {key: asin for asin, key in asin_images_keys(a for a in asins if a not in local).items()}
+    local_misses = sum(1 for data in local.values() if data is None)
+    metrics.asin_images_lookups.inc("local_hit", len(local) - local_misses)
+    metrics.asin_images_lookups.inc("negative_hit", local_misses)
+    if not keys:
+        return local
+    with timing.timed("cache"):
+        cached = cache.get_many(keys)
+    found = {keys[key]: None if data == ASIN_IMAGES_MISS else data for key, data in cached.items() if data}
+
+    missing = [asin for asin in keys.values() if asin not in found]
+    cached_misses = sum(1 for data in found.values() if data is None)
+    metrics.asin_images_lookups.inc("hit", len(found) - cached_misses)
+    metrics.asin_images_lookups.inc("negative_hit", cached_misses)
+    metrics.asin_images_lookups.inc("miss", len(missing))
+    if missing:
+        try:
+            products = list(AmazonProduct.objects.filter(asin__in=missing))
+        except Exception:
+            products = []
+        names = {asin: key for key, asin in keys.items()}
+        now = timezone.now()
+        to_cache = {}
+        misses = []
+        stale = []
+        for ap in products:
+            data = _asin_images_from_product(ap)
+            if data:
+                found[ap.asin] = data
+                to_cache[names[ap.asin]] = data
+                if _asin_images_stale(ap, now) and ap.queued_at is None:
+                    stale.append(ap.asin)
+            elif _asin_known_miss(ap, now):
+                found[ap.asin] = None
+                misses.append(ap)
+        if to_cache:
+            cache.set_many(to_cache, 60 * 60)  # 1 hour
+        if misses:
+            _cache_asin_misses([ap.asin for ap in misses], min(ap.next_retry_at for ap in misses))
+        if stale:
+            # Serve the stale images now; the refresh replaces them in the background
+            enqueue_asin_fetches(stale)
+
+    asin_images_local.set_many(found)
+    found.update(local)
+    return found
+
+
+def _store_asin_images_many(fetched) -> Dict[str, Optional[Tuple[str, str, Optional[str]]]]:
+    """
+    Store a fetch_paapi_images_many result in AmazonProduct; misses are
+    recorded with their next retry and map to None, except that a miss
+    keeps images stored before it until their hard TTL. One read, one
+    upsert, a cache.set_many per outcome and a single invalidation for the
+    whole batch, with no per-row post_save.
+    """
+    if not fetched:
+        return {}
+    now = timezone.now()
+    existing = AmazonProduct.objects.in_bulk(list(fetched), field_name="asin")
+
+    rows = []
+    results = {}
+    for asin, item in fetched.items():
+        previous = existing.get(asin)
+        kept = None if item else _asin_images_from_product(previous)
+        if kept:
+            # A refresh that found nothing only moves the retry on
+            attempts = previous.fetch_attempts + 1
+            rows.append(
+                AmazonProduct(
+                    asin=asin,
+                    title=previous.title,
+                    image_url=previous.image_url,
+                    image_url_2x=previous.image_url_2x,
+                    last_fetched_at=previous.last_fetched_at,
+                    fetch_status=previous.fetch_status,
+                    queued_at=None,
+                    fetch_attempts=attempts,
+                    next_retry_at=now + _asin_retry_delay(attempts),
+                )
+            )
+            results[asin] = kept
+            continue
+        item = item or {}
+        image_url = item.get("image_url")
+        image_url_2x = item.get("image_url_2x")
+        attempts = 0 if image_url else (previous.fetch_attempts if previous else 0) + 1
+        rows.append(
+            AmazonProduct(
+                asin=asin,
+                title=item.get("title") or (previous.title if previous else None),
+                image_url=image_url,
+                image_url_2x=image_url_2x,
+                last_fetched_at=now,
+                fetch_status="ok" if item else "miss",
+                queued_at=None,
+                fetch_attempts=attempts,
+                next_retry_at=None if image_url else now + _asin_retry_delay(attempts),
+            )
+        )
+        results[asin] = None
         if image_url:
-            data = (image_url, image_url_2x or image_url, title)
-            cache.set(f"asin-images:{asin}", data, 60 * 60)
-            return data
-    except Exception:
-        pass
-    return None
+            results[asin] = (image_url, image_url_2x or image_url, item.get("title"))
+
+    AmazonProduct.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=["asin"],
+        update_fields=[
+            "title",
+            "image_url",
+            "image_url_2x",
+            "last_fetched_at",
+            "fetch_status",
+            "queued_at",
+            "fetch_attempts",
+            "next_retry_at",
+        ],
+    )
+    asin_images_changed(list(fetched))
+    misses = [row for row in rows if not results[row.asin]]
+
+    def prime():
+        # Cached after the invalidation above has moved each ASIN's generation on
+        keys = asin_images_keys(asin for asin, data in results.items() if data)
+        if keys:
+            cache.set_many({keys[asin]: results[asin] for asin in keys}, 60 * 60)
+        if misses:
+            _cache_asin_misses([row.asin for row in misses], min(row.next_retry_at for row in misses))
+
+    transaction.on_commit(prime)
+    return results
 
 
-def get_asin_image_urls(asin: str) -> Optional[Tuple[str, str, Optional[str]]]:
-    """Resolve image URLs for an ASIN using DB cache then PA-API; returns (src, src2x, title)."""
-    # 1) Cache/DB
-    cached = _get_cached_asin_images(asin)
-    if cached:
-        return cached
+def _fetch_asin_images_many(asins, verbose: bool = False) -> Dict[str, Optional[Tuple[str, str, Optional[str]]]]:
+    """Fetch and store many ASINs via batched PA-API GetItems calls; misses map to None."""
+    from . import amazon_api
 
-    # 2) Try PA-API fetch
+    return _store_asin_images_many(amazon_api.fetch_paapi_images_many(asins, verbose=verbose))
+
+
+def enqueue_asin_fetches(asins) -> None:
+    """
+    Queue unknown or stale ASINs, and misses whose retry is due, for
+    process_asin_queue instead of fetching inline.
+    """
+    asins = list(dict.fromkeys(asins))
+    if not asins:
+        return
+    now = timezone.now()
     try:
-        from . import amazon_api
-
-        fetched = amazon_api.fetch_paapi_images(asin)
-        if fetched:
-            return _store_asin_images(
-                asin,
-                fetched.get("image_url"),
-                fetched.get("image_url_2x"),
-                fetched.get("title"),
-                status="ok",
+        # A savepoint, so a failed write here does not abort a surrounding
+        # transaction such as an admin save
+        with transaction.atomic():
+            AmazonProduct.objects.bulk_create(
+                [AmazonProduct(asin=asin, fetch_status="queued", queued_at=now) for asin in asins],
+                ignore_conflicts=True,
             )
-        else:
-            # negative cache briefly to avoid hammering on failures
-            cache.set(f"asin-images:{asin}", None, 60 * 5)
-            _store_asin_images(asin, None, None, None, status="miss")
-            return None
+            AmazonProduct.objects.filter(
+                Q(next_retry_at__isnull=True) | Q(next_retry_at__lte=now),
+                asin__in=asins,
+                queued_at__isnull=True,
+                last_fetched_at__lt=now - timezone.timedelta(seconds=settings.AMAZON_IMAGE_SOFT_TTL),
+            ).exclude(image_url__isnull=True).exclude(image_url="").update(queued_at=now)
+            AmazonProduct.objects.filter(
+                asin__in=asins,
+                queued_at__isnull=True,
+                next_retry_at__lte=now,
+            ).update(queued_at=now)
     except Exception:
-        # On any error, do not break page render
+        # Never break page render over the queue
+        pass
+
+
+def asin_images_expiry(asins):
+    """
+    When HTML showing these ASINs' stored images needs recompiling: the
+    earliest soft TTL still ahead, the hard TTL of images already past it
+    (or their retry, if a refresh found nothing), or the retry of a known
+    miss. Stored HTML is not rendered again before then, so images past
+    the soft TTL are queued for their refresh here.
+    """
+    asins = list(asins)
+    if not asins:
         return None
+    now = timezone.now()
+    soft_ttl = timezone.timedelta(seconds=settings.AMAZON_IMAGE_SOFT_TTL)
+    hard_ttl = timezone.timedelta(seconds=settings.AMAZON_IMAGE_HARD_TTL)
+    deadlines = []
+    stale = []
+    for ap in AmazonProduct.objects.filter(asin__in=asins).only(
+        "asin", "image_url", "last_fetched_at", "next_retry_at", "queued_at"
+    ):
+        if ap.image_url and ap.last_fetched_at:
+            if ap.last_fetched_at + soft_ttl > now:
+                deadlines.append(ap.last_fetched_at + soft_ttl)
+            elif ap.last_fetched_at + hard_ttl > now:
+                deadlines.append(ap.last_fetched_at + hard_ttl)
+                if not _asin_images_stale(ap, now):
+                    deadlines.append(ap.next_retry_at)
+                elif ap.queued_at is None:
+                    stale.append(ap.asin)
+        elif ap.next_retry_at and ap.next_retry_at > now:
+            deadlines.append(ap.next_retry_at)
+    if stale:
+        enqueue_asin_fetches(stale)
+    return min(deadlines, default=None)
+
+
+def get_asin_image_urls_many(asins, local=True) -> Dict[str, Tuple[str, str, Optional[str]]]:
+    """
+    Resolve many ASINs from cache/DB without calling PA-API; ASINs without
+    images are queued for the background fetch and left out of the result.
+    """
+    asins = list(dict.fromkeys(asins))
+    cached = _get_cached_asin_images_many(asins, local=local)
+    # Known misses are neither shown nor queued again before their retry
+    enqueue_asin_fetches([asin for asin in asins if asin not in cached])
+    return {asin: data for asin, data in cached.items() if data}
 
 
-def get_thumbnail(asin, alt, idx=None):
+def get_thumbnail(asin, alt, idx=None, images=None):
         asin_formatted = "#{idx}: ".format(idx=idx) if idx else ""
 
-        # Try to resolve images via stored/fetched URLs
-        resolved = get_asin_image_urls(asin)
+        # Try to resolve images via stored URLs, or the prefetched map
+        if images is None:
+                images = get_asin_image_urls_many([asin])
+        resolved = images.get(asin)
         if resolved:
                 src, src2x, title = resolved
                 alt_text = alt or title or "Amazon product"
@@ -161,15 +421,21 @@ def get_thumbnail(asin, alt, idx=None):
         )
 
 
-def asinline_to_thumbnail(line, idx):
+def asinline_params(line):
     params = [s.strip() for s in line.split(" ")[1:]]
     asin = params.pop(0)
     alt = " ".join(params)
 
-    return get_thumbnail(asin, alt, idx)
+    return asin, alt
+
 
+def asinline_to_thumbnail(line, idx, images=None):
+    asin, alt = asinline_params(line)
 
-def asinpline_to_paragraph(line):
+    return get_thumbnail(asin, alt, idx, images=images)
+
+
+def asinpline_to_paragraph(line, images=None):
     result = RE_ASINP.match(line)
     asin = result.group(1)
     alt = result.group(2)
@@ -183,7 +449,7 @@ def asinpline_to_paragraph(line):
   <div class="asin-p-right">{text}</div>
 </div>
 """.format(
-        thumbnail=get_thumbnail(asin, alt),
+        thumbnail=get_thumbnail(asin, alt, images=images),
         text=text,
     )
 
@@ -257,11 +523,191 @@ def process_asin_tracking(content):
     return content
 
 
+def render_content_html_legacy(content, markup):
+    """
+    The original multi-pass pipeline, kept to check compile_asin_markup against
+    """
+    content = process_asin_thumbnails(content)
+    content = process_asin_paragraphs(content)
+    content = process_asin_links(content)
+    content = process_twitter_links(content)
+
+    if markup == "markdown":
+        content = markdown.markdown(content)
+
+    content = process_link_targets(content)
+    content = process_asin_tracking(content)
+
+    return content
+
+
+def _inline_reference(m):
+    handle_prefix, handle_asin, asin, handle = m.groups()
+    if handle_asin:
+        return "https://twitter.com/{}{}".format(handle_prefix, asin_to_url(handle_asin))
+    if asin:
+        return asin_to_url(asin)
+    return "https://twitter.com/{}".format(handle)
+
+
+def process_inline_references(content):
+    return INLINE_REFERENCES.sub(_inline_reference, content)
+
+
+def _link_attributes(m):
+    asin = m.group(1)
+    if asin:
+        return "target=\"_blank\" onClick=\"trackAsinClick('{}')\" {}".format(
+            asin, m.group(0)
+        )
+    return 'target="_blank" {}'.format(m.group(0))
+
+
+def process_link_attributes(content):
+    return LINK_ATTRIBUTES.sub(_link_attributes, content)
+
+
+def referenced_asins(content):
+    """
+    Every ASIN an article refers to (ASIN lines, inline ASINs and ASINP cards)
+    """
+    asins = [m.group(1) for m in RE_ASIN.finditer(content or "")]
+    asins.extend(m.group(1) for m in RE_ASINP_ASIN.finditer(content or ""))
+
+    return list(dict.fromkeys(asins))
+
+
+def thumbnail_asins(lines):
+    """
+    ASINs that compile_asin_markup renders as cards, in order of appearance
+    """
+    asins = []
+    for line in lines:
+        if RE_ASIN.match(line):
+            asins.append(asinline_params(line)[0])
+        else:
+            result = RE_ASINP.match(line)
+            if result:
+                asins.append(result.group(1))
+
+    return list(dict.fromkeys(asins))
+
+
+def compile_asin_markup(lines, images=None, local=True):
+    """
+    Expand ASIN decks, ASINP paragraphs, inline ASINs and @handles in one pass.
+
+    Produces the same lines as process_asin_thumbnails, process_asin_paragraphs,
+    process_asin_links and process_twitter_links run in sequence. Card images are
+    resolved for the whole document up front unless an images map is passed.
+    """
+    if images is None:
+        images = get_asin_image_urls_many(thumbnail_asins(lines), local=local)
+
+    new_lines = []
+    deck_started = False
+    idx = 1
+
+    for line in lines:
+        if RE_ASIN.match(line):
+            if not deck_started:
+                idx = 1
+                new_lines.append('<div class="card-deck">')
+                deck_started = True
+
+            new_lines.append(process_inline_references(asinline_to_thumbnail(line, idx, images)))
+            idx += 1
+            continue
+
+        if deck_started:
+            new_lines.append("</div>")
+            deck_started = False
+
+        if RE_ASINP.match(line):
+            line = asinpline_to_paragraph(line, images)
+
+        new_lines.append(process_inline_references(line))
+
+    if deck_started:
+        new_lines.append("</div>")
+
+    return new_lines
+
+
+class AsinPreprocessor(Preprocessor):
+    def __init__(self, md=None, local=True):
+        super().__init__(md)
+        self.local = local
+
+    def run(self, lines):
+        return compile_asin_markup(lines, local=self.local)
+
+
+class AsinExtension(Extension):
+    """
+    Python-Markdown extension for ASIN, ASINP and @handle markup
+    """
+
+    def __init__(self, local=True, **kwargs):
+        self.local = local
+        super().__init__(**kwargs)
+
+    def extendMarkdown(self, md):
+        # Ahead of normalize_whitespace (30), where the old passes ran
+        md.preprocessors.register(AsinPreprocessor(md, local=self.local), "asin", 35)
+
+
+# What listing templates (home, /all/, the sidebar) read from an article
+LISTING_FIELDS = (
+    "id",
+    "slug",
+    "title",
+    "title_short",
+    "image",
+    "description",
+    "featured",
+    "published_at",
+    "modified_at",
+)
+
+# What the shared "All Articles" navigation shows, or decides when it changes
+NAVIGATION_FIELDS = ("slug", "title_short", "published_at", "modified_at")
+
+
+def navigation_state(values):
+    """
+    The NAVIGATION_FIELDS present in values, with modified_at cut down to the
+    month the navigation shows
+    """
+    state = {name: values[name] for name in NAVIGATION_FIELDS if name in values}
+    if state.get("modified_at"):
+        state["modified_at"] = (state["modified_at"].year, state["modified_at"].month)
+    return state
+
+
+class ArticleQuerySet(models.QuerySet):
+    def published(self):
+        return self.filter(published_at__lte=timezone.now())
+
+    def listing(self):
+        """
+        Only the columns listings show, leaving out content and compiled HTML
+        """
+        return self.only(*LISTING_FIELDS)
+
+
 class Article(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     modified_at = models.DateTimeField(auto_now=True)
-    published_at = models.DateTimeField(null=True, blank=True)
-    history = HistoricalRecords()
+    published_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    history = HistoricalRecords(
+        excluded_fields=[
+            "content_html_compiled",
+            "content_html_digest",
+            "content_html_expires_at",
+            "content_html_compiled_at",
+        ]
+    )
     featured = models.BooleanField(default=False)
 
     markup = models.CharField(
@@ -281,9 +727,28 @@ class Article(models.Model):
     content = models.TextField("Content")
     disqus_src = models.TextField("Disqus override source", null=True, blank=True)
 
+    # Precompiled content_html, valid while content_html_digest matches
+    content_html_compiled = models.TextField(null=True, blank=True, editable=False)
+    content_html_digest = models.CharField(
+        max_length=40, null=True, blank=True, editable=False
+    )
+    # ...and until the images it embeds go stale (see asin_images_expiry)
+    content_html_expires_at = models.DateTimeField(null=True, blank=True, editable=False)
+    content_html_compiled_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    objects = ArticleQuerySet.as_manager()
+
     class Meta:
         ordering = ["-published_at", "-modified_at"]
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_navigation = navigation_state(
+            {name: value for name, value in zip(field_names, values) if value is not DEFERRED}
+        )
+        return instance
+
     def __unicode__(self):
         return self.title
 
@@ -295,41 +760,424 @@ class Article(models.Model):
     def published(self):
         return self.published_at is not None
 
+    def navigation_changed(self):
+        """
+        Whether saving changed anything the navigation shows, or when it next
+        changes, compared with the values loaded from the database
+        """
+        loaded = getattr(self, "_loaded_navigation", None)
+        if loaded is None:
+            return True
+        if not (self.published_at or loaded.get("published_at")):
+            return False
+        current = navigation_state(self.__dict__)
+        return any(value != current.get(name) for name, value in loaded.items())
+
+    def render_content_html(self):
+        # Rendered HTML is stored until the ASINs change again, so it skips the
+        # in-process cache, which may not have seen the latest eviction yet
+        with timing.timed("markup"), metrics.content_html_render_seconds.time():
+            if self.markup == "markdown":
+                content = markdown.markdown(self.content, extensions=[AsinExtension(local=False)])
+            else:
+                content = "\n".join(compile_asin_markup(self.content.split("\n"), local=False))
+
+            return process_link_attributes(content)
+
+    def content_html_source_digest(self):
+        source = "{}:{}:{}".format(CONTENT_HTML_VERSION, self.markup, self.content)
+        return hashlib.sha1(source.encode("utf-8")).hexdigest()
+
+    def compile_content_html(self):
+        self.content_html_compiled = self.render_content_html()
+        self.content_html_digest = self.content_html_source_digest()
+        self.content_html_compiled_at = timezone.now()
+        self.content_html_expires_at = asin_images_expiry(thumbnail_asins(self.content.split("\n")))
+
     @property
-    def content_html(self):
-        content = self.content
-        content = process_asin_thumbnails(content)
-        content = process_asin_paragraphs(content)
-        content = process_asin_links(content)
-        content = process_twitter_links(content)
+    def content_html_fresh(self):
+        return (
+            self.content_html_compiled is not None
+            and self.content_html_digest == self.content_html_source_digest()
+            and (self.content_html_expires_at is None or self.content_html_expires_at > timezone.now())
+        )
 
-        if self.markup == "markdown":
-            content = markdown.markdown(content)
+    def refresh_content_html(self):
+        """
+        Recompile and persist the stored HTML without touching modified_at
+        """
+        self.compile_content_html()
+        if self.pk:
+            # update() skips signals, so this does not flush the cache
+            Article.objects.filter(pk=self.pk).update(
+                content_html_compiled=self.content_html_compiled,
+                content_html_digest=self.content_html_digest,
+                content_html_expires_at=self.content_html_expires_at,
+                content_html_compiled_at=self.content_html_compiled_at,
+            )
 
-        content = process_link_targets(content)
-        content = process_asin_tracking(content)
+    @property
+    def content_html(self):
+        if not self.content_html_fresh:
+            self.refresh_content_html()
+        return self.content_html_compiled
+
+    def sync_asins(self):
+        """
+        Bring this article's ArticleAsin rows in line with its content
+        """
+        wanted = set(referenced_asins(self.content))
+        existing = set(self.asins.values_list("asin", flat=True))
+        if existing - wanted:
+            self.asins.filter(asin__in=existing - wanted).delete()
+        if wanted - existing:
+            ArticleAsin.objects.bulk_create(
+                [ArticleAsin(article=self, asin=asin) for asin in wanted - existing],
+                ignore_conflicts=True,
+            )
 
-        return content
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        content_changed = update_fields is None or "content" in update_fields
+        if update_fields is None:
+            self.compile_content_html()
+        elif {"content", "markup"} & set(update_fields):
+            self.compile_content_html()
+            kwargs["update_fields"] = set(update_fields) | {
+                "content_html_compiled",
+                "content_html_digest",
+                "content_html_expires_at",
+                "content_html_compiled_at",
+            }
+        super().save(*args, **kwargs)
+        self._loaded_navigation = navigation_state(self.__dict__)
+        if content_changed:
+            self.sync_asins()
+        if update_fields is None or RELATED_SOURCE_FIELDS & set(update_fields):
+            self.refresh_related()
+        if update_fields is None or SITEMAP_SOURCE_FIELDS & set(update_fields):
+            sync_sitemap_entry(self)
+
+    def refresh_related(self):
+        """
+        Recompute related candidates for this article and the articles whose
+        candidates it could enter or leave
+        """
+        rebuild_related(around=self.pk)
+
+    def get_related(self, num=4):
+        """
+        num published articles drawn at random from the stored candidates,
+        topped up with recent articles when there are too few
+        """
+        candidates = list(
+            Article.objects.published().listing().filter(related_from__article=self)
+        )
+        picks = random.sample(candidates, min(num, len(candidates)))
+        if len(picks) < num:
+            picks += list(
+                Article.objects.published()
+                .listing()
+                .exclude(pk__in=[self.pk] + [a.pk for a in picks])
+                .order_by("-published_at")[: num - len(picks)]
+            )
+        return picks
 
     @property
-    def related(self, num=4):
-        return list(
-            Article.objects.filter(published_at__lte=timezone.now())
-            .exclude(id=self.id)
-            .order_by("?")
-        )[:num]
+    def related(self):
+        return self.get_related()
 
     @property
     def canonical_url(self):
         return "https://wheretostartreading.com/articles/{}/".format(self.slug)
 
     def get_absolute_url(self):
-        return reverse("blog.views.article", args=[self.slug])
+        return reverse("article", args=[self.slug])
+
+
+class ArticleAsin(models.Model):
+    """ASIN-to-article index, kept in step with Article.content on save."""
+
+    article = models.ForeignKey(Article, on_delete=models.CASCADE, related_name="asins")
+    asin = models.CharField(max_length=10, db_index=True)
+
+    def __str__(self):
+        return f"{self.asin} in {self.article_id}"
+
+    class Meta:
+        unique_together = [("article", "asin")]
+
+
+class RelatedArticle(models.Model):
+    """Precomputed related-article candidates, rebuilt by rebuild_related."""
+
+    article = models.ForeignKey(Article, on_delete=models.CASCADE, related_name="related_candidates")
+    related = models.ForeignKey(Article, on_delete=models.CASCADE, related_name="related_from")
+    score = models.FloatField()
+
+    def __str__(self):
+        return f"{self.related_id} for {self.article_id} ({self.score:.2f})"
+
+    class Meta:
+        ordering = ["article", "-score"]
+        unique_together = [("article", "related")]
+
+
+RELATED_CANDIDATES = 12
+RELATED_ASIN_WEIGHT = 3.0
+RELATED_SOURCE_FIELDS = {"content", "title", "title_short", "description", "published_at"}
+RE_RELATED_TERM = re.compile(r"[a-z0-9]+")
+RELATED_STOPWORDS = frozenset(
+    "a an and are as at be by for from how in into is it of on or the to with".split()
+)
+
+
+def related_terms(*texts):
+    terms = set()
+    for text in texts:
+        for term in RE_RELATED_TERM.findall((text or "").lower()):
+            if len(term) > 2 and term not in RELATED_STOPWORDS:
+                terms.add(term)
+    return terms
+
+
+def related_features(articles, references):
+    """
+    Map article id -> (asins, terms) from (id, title, title_short, description)
+    rows and (article_id, asin) rows
+    """
+    features = {}
+    for pk, title, title_short, description in articles:
+        features[pk] = (set(), related_terms(title, title_short, description))
+    for article_id, asin in references:
+        if article_id in features:
+            features[article_id][0].add(asin)
+    return features
+
+
+def related_candidates(features, article_ids, limit=RELATED_CANDIDATES):
+    """
+    Top limit (score, related_id) pairs for each of article_ids, or every
+    pair scoring above zero when limit is None.
+    Shared ASINs score RELATED_ASIN_WEIGHT each; shared title and description
+    terms score their inverse document frequency, so words every guide uses
+    count for little.
+    """
+    counts = {}
+    for _, terms in features.values():
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+    idf = {term: math.log(len(features) / count) for term, count in counts.items()}
+
+    candidates = {}
+    for pk in article_ids:
+        asins, terms = features[pk]
+        scores = []
+        for other, (other_asins, other_terms) in features.items():
+            if other == pk:
+                continue
+            score = RELATED_ASIN_WEIGHT * len(asins & other_asins)
+            score += sum(idf[term] for term in terms & other_terms)
+            if score > 0:
+                scores.append((score, other))
+        candidates[pk] = heapq.nlargest(limit, scores) if limit else sorted(scores, reverse=True)
+    return candidates
+
+
+def rebuild_related(around=None):
+    """
+    Rebuild RelatedArticle rows: for every article, or with around=pk, for
+    that article plus any article that scores against it or lists it now.
+    Only articles with a published_at are scored or listed; drafts get no
+    rows. Returns the number of articles rebuilt.
+    """
+    features = related_features(
+        Article.objects.exclude(published_at=None).values_list("pk", "title", "title_short", "description"),
+        ArticleAsin.objects.exclude(article__published_at=None).values_list("article_id", "asin"),
+    )
+    if around is None:
+        article_ids = list(features)
+        stale = RelatedArticle.objects.all()
+    else:
+        article_ids = {around}
+        if around in features:
+            article_ids.update(other for _, other in related_candidates(features, [around], limit=None)[around])
+        # A draft, or an article just unpublished, also leaves the lists it was on
+        article_ids.update(RelatedArticle.objects.filter(related_id=around).values_list("article_id", flat=True))
+        stale = RelatedArticle.objects.filter(article_id__in=article_ids)
+
+    candidates = related_candidates(features, [pk for pk in article_ids if pk in features])
+    with transaction.atomic():
+        stale.delete()
+        RelatedArticle.objects.bulk_create(
+            [
+                RelatedArticle(article_id=pk, related_id=other, score=score)
+                for pk, scored in candidates.items()
+                for score, other in scored
+            ]
+        )
+    return len(article_ids)
+
+
+class SitemapEntry(models.Model):
+    """
+    One pre-rendered sitemap <url>. xml holds what follows <loc>, which gets
+    the request's scheme and host prepended when served.
+    """
+
+    location = models.CharField(max_length=255, unique=True)
+    article = models.OneToOneField(
+        Article, null=True, blank=True, on_delete=models.CASCADE, related_name="sitemap_entry"
+    )
+    # Listed once this has passed; null for pages that are always listed
+    published_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    lastmod = models.DateTimeField(null=True, blank=True)
+    xml = models.TextField()
+
+    def __str__(self):
+        return self.location
+
+    class Meta:
+        verbose_name_plural = "sitemap entries"
+
+
+SITEMAP_SOURCE_FIELDS = {"slug", "published_at", "modified_at"}
+
+
+def sitemap_url_xml(lastmod=None, changefreq=None, priority=None):
+    """The <url> children after <loc>, as django.contrib.sitemaps renders them"""
+    xml = ""
+    if lastmod:
+        xml += "<lastmod>{}</lastmod>".format(timezone.localtime(lastmod).strftime("%Y-%m-%d"))
+    if changefreq:
+        xml += "<changefreq>{}</changefreq>".format(changefreq)
+    if priority:
+        xml += "<priority>{}</priority>".format(priority)
+    return xml + "</url>"
+
+
+def sync_sitemap_entry(article):
+    """
+    Bring the article's SitemapEntry in line with it; unpublished articles
+    have none. Scheduled articles get theirs now and are listed from
+    published_at on.
+    """
+    try:
+        location = article.get_absolute_url() if article.published_at else None
+    except NoReverseMatch:
+        location = None
+    if location is None:
+        SitemapEntry.objects.filter(article=article).delete()
+        return
+    SitemapEntry.objects.update_or_create(
+        article=article,
+        defaults={
+            "location": location,
+            "published_at": article.published_at,
+            "lastmod": article.modified_at,
+            "xml": sitemap_url_xml(lastmod=article.modified_at, priority="0.6"),
+        },
+    )
+
+
+def rebuild_sitemap():
+    """Regenerate every SitemapEntry; returns how many there are."""
+    with transaction.atomic():
+        SitemapEntry.objects.all().delete()
+        entries = [
+            SitemapEntry(
+                location=reverse("home"),
+                xml=sitemap_url_xml(changefreq="daily", priority="0.5"),
+            )
+        ]
+        for article in Article.objects.exclude(published_at=None).only(
+            "id", "slug", "published_at", "modified_at"
+        ):
+            try:
+                location = article.get_absolute_url()
+            except NoReverseMatch:
+                continue
+            entries.append(
+                SitemapEntry(
+                    location=location,
+                    article=article,
+                    published_at=article.published_at,
+                    lastmod=article.modified_at,
+                    xml=sitemap_url_xml(lastmod=article.modified_at, priority="0.6"),
+                )
+            )
+        SitemapEntry.objects.bulk_create(entries)
+    return len(entries)
+
+
+def mark_asin_articles_stale(asins):
+    """
+    Mark compiled HTML stale for articles that embed any of these ASINs
+    """
+    if asins:
+        Article.objects.filter(asins__asin__in=list(asins)).update(content_html_digest=None)
+
+
+def article_page_paths(articles):
+    """
+    Cached pages that show these articles' content
+    """
+    paths = []
+    for article in articles:
+        try:
+            paths.append(reverse("article", kwargs={"slug": article.slug}))
+        except NoReverseMatch:
+            # Slugs the URL pattern can't route have no page to evict
+            pass
+    return paths
+
+
+def asin_images_changed(asins):
+    """
+    Invalidate what depends on these ASINs' images: cached image tuples, the
+    compiled HTML and cached pages of the articles that embed them. Bulk
+    writes call this once per batch since they fire no post_save.
+
+    This runs once the surrounding transaction commits; before then a
+    request would re-cache the old rows under the new keys. The generations
+    move before the articles are marked stale, so an article recompiled
+    straight after cannot pick up the old tuples.
+    """
+    asins = list(asins)
+
+    def invalidate():
+        evict_asin_images(asins)
+        mark_asin_articles_stale(asins)
+        evict_pages(article_page_paths(Article.objects.filter(asins__asin__in=asins).distinct().only("slug")))
+
+    transaction.on_commit(invalidate)
+
+
+@receiver(post_save, sender=AmazonProduct)
+def post_amazon_product_save(sender, instance, **kwargs):
+    asin_images_changed([instance.asin])
 
 
-@receiver(post_save)
-def post_model_save(sender, instance, **kwargs):
+@receiver(post_save, sender=Article)
+@receiver(post_delete, sender=Article)
+def post_article_change(sender, instance, **kwargs):
     """
-    Clear cache when any kind of Model is saved
+    Evict the article's page plus the listings that link to it, and every
+    page when the shared navigation changed, once the save commits
     """
-    cache.clear()
+    if kwargs["signal"] is post_delete:
+        navigation_changed = instance.published_at is not None
+    else:
+        navigation_changed = instance.navigation_changed()
+    paths = article_page_paths([instance]) + [
+        reverse("home"),
+        reverse("all"),
+        reverse("django.contrib.sitemaps.views.sitemap"),
+    ]
+
+    def evict():
+        if navigation_changed:
+            evict_navigation()
+        evict_pages(paths)
+
+    transaction.on_commit(evict)
@@ -0,0 +1,86 @@
+"""
+The sitemap, streamed from stored SitemapEntry rows.
+
+Entries are kept in step with articles on save (see sync_sitemap_entry), so
+serving the sitemap is one query over pre-rendered XML. Past
+SITEMAP_SHARD_SIZE entries, /sitemap.xml becomes a sitemap index of
+/sitemap-<n>.xml shards.
+"""
+from django.contrib.sitemaps.views import x_robots_tag
+from django.db.models import F, Q
+from django.http import Http404, StreamingHttpResponse
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import SitemapEntry
+
+# The sitemap protocol allows at most 50,000 URLs per file
+SITEMAP_SHARD_SIZE = 50000
+
+URLSET_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" xmlns:xhtml="http://www.w3.org/1999/xhtml">\n'
+)
+URLSET_FOOTER = "\n</urlset>\n"
+INDEX_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+)
+INDEX_FOOTER = "\n</sitemapindex>\n"
+
+
+def listed_entries():
+    """Entries whose page is live now, articles newest first and the homepage last"""
+    return (
+        SitemapEntry.objects.filter(Q(published_at=None) | Q(published_at__lte=timezone.now()))
+        .order_by(F("published_at").desc(nulls_last=True), F("lastmod").desc(nulls_last=True), "id")
+    )
+
+
+def shard_count():
+    return max(1, -(-listed_entries().count() // SITEMAP_SHARD_SIZE))
+
+
+def shard_paths():
+    """Paths of the shards the index lists; none while one file holds everything"""
+    shards = shard_count()
+    if shards == 1:
+        return []
+    return [reverse("sitemap-shard", kwargs={"section": n}) for n in range(1, shards + 1)]
+
+
+def _stream_urlset(base, entries):
+    yield URLSET_HEADER
+    for location, xml in entries.values_list("location", "xml").iterator():
+        yield "<url><loc>{}{}</loc>{}".format(base, location, xml)
+    yield URLSET_FOOTER
+
+
+def _stream_index(base, paths):
+    yield INDEX_HEADER
+    for path in paths:
+        yield "<sitemap><loc>{}{}</loc></sitemap>".format(base, path)
+    yield INDEX_FOOTER
+
+
+def _response(chunks):
+    return StreamingHttpResponse(chunks, content_type="application/xml")
+
+
+@x_robots_tag
+def sitemap(request):
+    base = "{}://{}".format(request.scheme, request.get_host())
+    paths = shard_paths()
+    if paths:
+        return _response(_stream_index(base, paths))
+    return _response(_stream_urlset(base, listed_entries()))
+
+
+@x_robots_tag
+def sitemap_shard(request, section):
+    section = int(section)
+    if not 1 <= section <= shard_count():
+        raise Http404("No such sitemap shard")
+    base = "{}://{}".format(request.scheme, request.get_host())
+    start = (section - 1) * SITEMAP_SHARD_SIZE
+    return _response(_stream_urlset(base, listed_entries()[start:start + SITEMAP_SHARD_SIZE]))
@@ -0,0 +1,67 @@
+"""
+Per-request timing for Server-Timing.
+
+ServerTimingMiddleware opens an accumulator for each request; code paths
+worth seeing in production report into it with timed() or record(). Outside
+a request (commands, the queue worker) there is no accumulator and both are
+close to free.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+_timings = ContextVar("blog_timings", default=None)
+
+# Metric name -> Server-Timing description
+METRICS = {
+    "db": "Database",
+    "cache": "Cache lookups",
+    "paapi": "PA-API",
+    "markup": "Markdown and ASIN markup",
+}
+
+
+def start():
+    """Begin accumulating for the current request; pass the token to stop()."""
+    return _timings.set({})
+
+
+def stop(token):
+    timings = _timings.get()
+    _timings.reset(token)
+    return timings or {}
+
+
+def record(name, seconds, count=1):
+    timings = _timings.get()
+    if timings is None:
+        return
+    total = timings.get(name)
+    if total is None:
+        timings[name] = [seconds, count]
+    else:
+        total[0] += seconds
+        total[1] += count
+
+
+@contextmanager
+def timed(name):
+    if _timings.get() is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started)
+
+
+def server_timing_header(timings, total):
+    """Server-Timing value: one entry per metric with its count, then the total"""
+    entries = []
+    for name, (seconds, count) in timings.items():
+        entries.append(
+            '{};dur={:.1f};desc="{} ({})"'.format(name, seconds * 1000, METRICS.get(name, name), count)
+        )
+    entries.append("total;dur={:.1f}".format(total * 1000))
+    return ", ".join(entries)
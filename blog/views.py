@@ -1,39 +1,143 @@
-from django.utils import timezone
+import hashlib
+import math
 
-from django.http import Http404
+from django.conf import settings
+from django.contrib.auth.views import redirect_to_login
+from django.core.cache import cache
+from django.db.models import Count, Max, Min
+from django.http import Http404, HttpResponse
 from django.shortcuts import render
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.cache import never_cache
+from django.views.decorators.http import condition
 
+from . import metrics as blog_metrics, timing
+from .caching import navigation_key
 from .models import Article
 
 
+def article_navigation():
+    """
+    The rendered "All Articles" sidebars, shared by every article page, and
+    when they were rendered. Kept under the navigation generation, and only
+    until the next scheduled article goes live.
+    """
+    key = navigation_key()
+    with timing.timed("cache"):
+        navigation = cache.get(key)
+    if navigation is None:
+        now = timezone.now()
+        articles = Article.objects.published().only("id", "slug", "title_short", "modified_at")
+        navigation = (render_to_string("article_nav.html", {"articles": articles}), now)
+
+        upcoming = Article.objects.filter(published_at__gt=now).aggregate(next=Min("published_at"))["next"]
+        timeout = math.ceil((upcoming - now).total_seconds()) if upcoming else None
+        cache.set(key, navigation, timeout)
+    return navigation
+
+
+def _validators(request, compute):
+    # condition() asks for the ETag and Last-Modified separately; work both out once
+    if not hasattr(request, "_validators"):
+        request._validators = compute()
+    return request._validators
+
+
+def _etag(*parts):
+    return hashlib.sha1(":".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+
+
+def listing_validators(request, *args, **kwargs):
+    """
+    (ETag, Last-Modified) for the pages listing published articles: one
+    aggregate, plus the navigation render time so removals and scheduled
+    publishes move Last-Modified forward too.
+    """
+
+    def compute():
+        state = Article.objects.published().aggregate(
+            count=Count("id"), modified=Max("modified_at"), published=Max("published_at")
+        )
+        _, rendered_at = article_navigation()
+        last_modified = max(filter(None, [state["modified"], state["published"], rendered_at]))
+        return _etag(state["count"], state["modified"], state["published"], rendered_at), last_modified
+
+    return _validators(request, compute)
+
+
+def listing_etag(request, *args, **kwargs):
+    return listing_validators(request)[0]
+
+
+def listing_last_modified(request, *args, **kwargs):
+    return listing_validators(request)[1]
+
+
+def _article(request, slug):
+    # Loaded once for both the validators and the view
+    if not hasattr(request, "_article"):
+        request._article = Article.objects.filter(slug=slug).first()
+    return request._article
+
+
+def article_validators(request, slug):
+    """
+    (ETag, Last-Modified) for an article page from its modified_at, its
+    compiled HTML and the navigation render time. Stale HTML is recompiled
+    first, so the validators move whenever the body would. (None, None)
+    when there is no such article, leaving the 404 to the view.
+    """
+
+    def compute():
+        article = _article(request, slug)
+        if article is None:
+            return None, None
+        if not article.content_html_fresh:
+            article.refresh_content_html()
+        compiled = hashlib.sha1(article.content_html_compiled.encode("utf-8")).hexdigest()
+        _, rendered_at = article_navigation()
+        last_modified = max(filter(None, [article.modified_at, article.content_html_compiled_at, rendered_at]))
+        return _etag(slug, article.modified_at, compiled, rendered_at), last_modified
+
+    return _validators(request, compute)
+
+
+def article_etag(request, slug):
+    return article_validators(request, slug)[0]
+
+
+def article_last_modified(request, slug):
+    return article_validators(request, slug)[1]
+
+
+@condition(etag_func=listing_etag, last_modified_func=listing_last_modified)
 def all(request):
-    articles = Article.objects.filter(published_at__lte=timezone.now()).all()
+    articles = Article.objects.published().listing()
 
     return render(request, "all.html", {"articles": articles})
 
 
+@condition(etag_func=listing_etag, last_modified_func=listing_last_modified)
 def home(request):
-    articles = (
-        Article.objects.filter(published_at__lte=timezone.now())
-        .order_by("-published_at")
-        .all()
-    )
+    articles = Article.objects.published().listing()
 
-    all = articles
+    articles_popular = articles.filter(featured=True).order_by("-published_at")
+    others = articles.filter(featured=False)
 
-    articles_popular = [a for a in articles if a.featured]
-    articles = [a for a in articles if not a.featured]
+    articles_published = list(others.order_by("-published_at")[:5])
 
-    articles_published = articles[:5]
-    articles = articles[5:]
-
-    articles_modified = sorted(articles, key=lambda x: x.modified_at, reverse=True)
+    articles_modified = others.exclude(
+        pk__in=[a.pk for a in articles_published]
+    ).order_by("-modified_at")
 
     return render(
         request,
         "home.html",
         {
-            "articles": all,
+            "articles": articles,
             "articles_popular": articles_popular,
             "articles_published": articles_published,
             "articles_modified": articles_modified,
@@ -41,10 +145,23 @@ def home(request):
     )
 
 
+@condition(etag_func=article_etag, last_modified_func=article_last_modified)
 def article(request, slug):
-    try:
-        articles = Article.objects.filter(published_at__lte=timezone.now())
-        article = Article.objects.get(slug=slug)
-    except Article.DoesNotExist:
+    article = _article(request, slug)
+    if article is None:
         raise Http404("Article does not exist")
-    return render(request, "article.html", {"article": article, "articles": articles})
+    navigation, _ = article_navigation()
+    return render(request, "article.html", {"article": article, "navigation": navigation})
+
+
+@never_cache
+def metrics(request):
+    """
+    Prometheus metrics for staff, or for scrapers sending
+    "Authorization: Bearer <METRICS_TOKEN>".
+    """
+    token = settings.METRICS_TOKEN
+    scraper = bool(token) and constant_time_compare(request.headers.get("Authorization", ""), f"Bearer {token}")
+    if not scraper and not (request.user.is_active and request.user.is_staff):
+        return redirect_to_login(request.get_full_path(), reverse("admin:login"))
+    return HttpResponse(blog_metrics.export(), content_type=blog_metrics.CONTENT_TYPE)
@@ -46,8 +46,12 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Before everything else, so its total covers the whole stack
+    "blog.middleware.ServerTimingMiddleware",
+    # Outermost, so pages served from the cache also answer 304
+    "django.middleware.http.ConditionalGetMiddleware",
     "django.middleware.gzip.GZipMiddleware",
-    "django.middleware.cache.UpdateCacheMiddleware",
+    "blog.middleware.UpdateCacheMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -56,7 +60,7 @@ MIDDLEWARE = [
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "simple_history.middleware.HistoryRequestMiddleware",
-    "django.middleware.cache.FetchFromCacheMiddleware",
+    "blog.middleware.FetchFromCacheMiddleware",
 ]
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
@@ -148,6 +152,43 @@ STATICFILES_DIRS = (os.path.join(PROJECT_ROOT, "static"),)
 
 STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
 
+# Seconds stored Amazon product images stay usable. Past the soft TTL they
+# are still served while a background refresh is queued; past the hard TTL
+# they are not served at all.
+AMAZON_IMAGE_SOFT_TTL = int(os.environ.get("AMAZON_IMAGE_SOFT_TTL", 60 * 60 * 24 * 30))
+AMAZON_IMAGE_HARD_TTL = int(os.environ.get("AMAZON_IMAGE_HARD_TTL", 60 * 60 * 24 * 180))
+
+# Where export_static writes the rendered site. With STATIC_EXPORT_SERVE=True
+# whitenoise serves it (including the .gz/.br variants) ahead of Django.
+STATIC_EXPORT_ROOT = os.environ.get("STATIC_EXPORT_ROOT", os.path.join(BASE_DIR, "export"))
+STATIC_EXPORT_SERVE = os.environ.get("STATIC_EXPORT_SERVE", "False") == "True"
+
+# Server-Timing header on every response; SERVER_TIMING_LOG also logs each
+# request's breakdown as JSON to the "blog.timing" logger.
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "True") == "True"
+SERVER_TIMING_LOG = os.environ.get("SERVER_TIMING_LOG", "False") == "True"
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "stdout": {
+            "class": "logging.StreamHandler",
+            "stream": "ext://sys.stdout",
+        },
+    },
+    "loggers": {
+        "blog.timing": {
+            "handlers": ["stdout"],
+            "level": "INFO",
+            "propagate": False,
+        },
+    },
+}
+
+# Lets a Prometheus scraper read /gauntlet/metrics/ without a staff login
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
 if os.environ.get("MEMCACHIER_SERVERS", "") != "":
     DEBUG = False
 
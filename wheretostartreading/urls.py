@@ -1,46 +1,26 @@
-from django.utils import timezone
-
 from django.urls import include, re_path
 from django.contrib import admin
-from django.contrib.sitemaps.views import sitemap
-from django.contrib.sitemaps import GenericSitemap, Sitemap
-from django.urls import reverse
 from django.http import HttpResponse
+from django.views.decorators.http import condition
 
-from blog.models import Article
-
-
-class HomepageSitemap(Sitemap):
-    priority = 0.5
-    changefreq = "daily"
-
-    def items(self):
-        return ["home"]
-
-    def location(self, item):
-        return reverse(item)
+from blog.sitemaps import sitemap, sitemap_shard
+from blog.views import listing_etag, listing_last_modified, metrics
 
 
-sitemaps = {
-    "blog": GenericSitemap(
-        {
-            "queryset": Article.objects.filter(published_at__lte=timezone.now()),
-            "date_field": "modified_at",
-        },
-        priority=0.6,
-    ),
-    "homepage": HomepageSitemap,
-}
-
 urlpatterns = [
+    re_path(r"^gauntlet/metrics/$", metrics, name="metrics"),
     re_path(r"^gauntlet/", admin.site.urls),
     re_path(r"", include("blog.urls")),
     re_path(
         r"^sitemap\.xml$",
-        sitemap,
-        {"sitemaps": sitemaps},
+        condition(etag_func=listing_etag, last_modified_func=listing_last_modified)(sitemap),
         name="django.contrib.sitemaps.views.sitemap",
     ),
+    re_path(
+        r"^sitemap-(?P<section>[0-9]+)\.xml$",
+        condition(etag_func=listing_etag, last_modified_func=listing_last_modified)(sitemap_shard),
+        name="sitemap-shard",
+    ),
     re_path(
         r"^robots.txt$",
         lambda r: HttpResponse(
@@ -9,6 +9,7 @@ https://docs.djangoproject.com/en/1.9/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 from whitenoise import WhiteNoise
 
@@ -17,7 +18,13 @@ from django.core.cache.backends.memcached import BaseMemcachedCache
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "wheretostartreading.settings")
 
 application = get_wsgi_application()
-application = WhiteNoise(application)
+
+if settings.STATIC_EXPORT_SERVE:
+    # Exported pages are found at startup; re-run export_static and restart
+    application = WhiteNoise(application, index_file=True)
+    application.add_files(settings.STATIC_EXPORT_ROOT)
+else:
+    application = WhiteNoise(application)
 
 # Fix django closing connection to MemCachier after every request (#11331)
 BaseMemcachedCache.close = lambda self, **kwargs: None